@@ -0,0 +1,89 @@
+"""Measures near-duplicate reuse on a templated corpus: wall time, billed tokens, and cosine error.
+
+Embeds the same synthetic corpus of templated notifications with reuse disabled and at several Jaccard thresholds,
+against the local stand-in server. The cosine error compares each reused vector with the exact vector for its own
+text. Run from the repository root:
+
+    PYTHONPATH=src python -m benchmarks.near_duplicates
+"""
+import math
+import random
+import time
+from typing import Dict, List
+
+from steamship import Block, File
+from steamship.data.tags import TagValueKey
+from steamship.plugin.inputs.block_and_tag_plugin_input import BlockAndTagPluginInput
+from steamship.plugin.request import PluginRequest
+
+from api import OpenAIEmbedderPlugin
+from benchmarks.stand_in import stand_in_server
+from openai.client import OpenAIEmbeddingClient
+
+BLOCKS = 600
+TEMPLATES = [
+    "Hello {name}, your order #{order} shipped on {date}. Track it from your account page. Thank you for shopping "
+    "with us, and let us know if anything about your delivery is not right.",
+    "Reminder: the quarterly review for {name} is scheduled on {date}. Please upload your self assessment and the "
+    "project summary (ref {order}) at least two days before the meeting.",
+    "Security notice for {name}: a new sign-in to your account was detected on {date} from device {order}. If this "
+    "was you, no action is needed. Otherwise reset your password immediately.",
+]
+THRESHOLDS = [0.0, 0.9, 0.8, 0.7]
+
+
+def _corpus(seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    names = ["Ada", "Grace", "Alan", "Edsger", "Barbara", "Donald", "Frances", "Ken"]
+    texts = []
+    for _ in range(BLOCKS):
+        if rng.random() < 0.1:
+            texts.append(" ".join(rng.choice(names) + str(rng.randint(0, 9999)) for _ in range(25)))
+        else:
+            texts.append(rng.choice(TEMPLATES).format(
+                name=rng.choice(names),
+                order=rng.randint(10000, 99999),
+                date=f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            ))
+    return texts
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    return dot / (math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b)))
+
+
+def _embed(texts: List[str], threshold: float) -> Dict:
+    plugin = OpenAIEmbedderPlugin(config={"api_key": "benchmark", "near_duplicate_threshold": threshold})
+    file = File(id="corpus", blocks=[Block(id=str(i), text=text) for i, text in enumerate(texts)])
+    start = time.perf_counter()
+    output = plugin.run(PluginRequest(data=BlockAndTagPluginInput(file=file)))
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "tokens": sum(usage.operation_amount for usage in output.usage),
+        "tags": [block.tags[0] for block in output.file.blocks],
+    }
+
+
+def main():
+    texts = _corpus()
+    with stand_in_server(delay_seconds=0.005) as stand_in:
+        OpenAIEmbeddingClient.URL = stand_in.url
+        exact = _embed(texts, 0.0)
+        print(f"{'threshold':>9} {'seconds':>8} {'tokens':>7} {'reused':>6} {'mean cos err':>12} {'max cos err':>11}")
+        for threshold in THRESHOLDS:
+            run = exact if threshold == 0.0 else _embed(texts, threshold)
+            errors = [
+                1.0 - _cosine(tag.value[TagValueKey.VECTOR_VALUE], exact_tag.value[TagValueKey.VECTOR_VALUE])
+                for tag, exact_tag in zip(run["tags"], exact["tags"])
+                if tag.value.get("reused")
+            ]
+            print(
+                f"{threshold:>9.2f} {run['seconds']:>8.2f} {run['tokens']:>7} {len(errors):>6} "
+                f"{(sum(errors) / len(errors) if errors else 0.0):>12.4f} {max(errors, default=0.0):>11.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""A local stand-in for the OpenAI embeddings endpoint.
+
+Responds to every POST with one deterministic embedding per input, after an optional delay, so that benchmarks can
+exercise the real client code without network access or billing.
+
+The stand-in's vectors hash the character trigrams of the text into the embedding dimensions, so lexically similar
+texts get similar vectors. That makes cosine comparisons between stand-in vectors meaningful, if only lexically.
+
+`stand_in_server` speaks HTTP/1.1; `stand_in_h2_server` speaks cleartext HTTP/2 with prior knowledge. Both count the
+connections they accept.
+"""
+import asyncio
+import base64
+import json
+import math
+import threading
+import zlib
+from array import array
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Generator, List
+
+from openai.api_spec import MODEL_TO_DIMENSIONALITY, estimate_token_count
+
+
+def fake_embedding(text: str, dimensions: int) -> List[float]:
+    """A deterministic, unit-length, feature-hashed vector of the character trigrams of `text`."""
+    vector = [0.0] * dimensions
+    for i in range(max(len(text) - 2, 1)):
+        h = zlib.crc32(text[i:i + 3].encode("utf-8"))
+        vector[h % dimensions] += 1.0 if h & 0x80000000 else -1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def fake_response(body: dict) -> dict:
+    inputs = body["input"]
+    dimensions = MODEL_TO_DIMENSIONALITY.get(body["model"], 1536)
+    encode = (
+        (lambda vector: base64.b64encode(array("f", vector).tobytes()).decode("ascii"))
+        if body.get("encoding_format") == "base64" else (lambda vector: vector)
+    )
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": encode(fake_embedding(text, dimensions))}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": sum(estimate_token_count(text) for text in inputs)},
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Replies are written in several small chunks; without TCP_NODELAY, Nagle plus delayed ACKs adds ~40 ms each.
+    disable_nagle_algorithm = True
+    delay_seconds = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.delay_seconds:
+            threading.Event().wait(self.delay_seconds)
+        payload = json.dumps(fake_response(body)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_HEAD(self):
+        # What OpenAI answers to a HEAD request, as sent by `prewarm`: an empty response on a kept-alive connection.
+        self.send_response(405)
+        self.send_header("Allow", "POST")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn:
+    """A running stand-in server: its URL and how many client connections it has accepted."""
+
+    def __init__(self):
+        self.url = ""
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+
+@contextmanager
+def stand_in_server(delay_seconds: float = 0.0) -> Generator[StandIn, None, None]:
+    """Serves the HTTP/1.1 stand-in on a free local port for the duration of the block."""
+    stand_in = StandIn()
+    handler = type("Handler", (_Handler,), {"delay_seconds": delay_seconds})
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def process_request(self, request, client_address):
+            stand_in.count_connection()
+            super().process_request(request, client_address)
+
+    server = Server(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stand_in.url = f"http://127.0.0.1:{server.server_address[1]}/v1/embeddings"
+    try:
+        yield stand_in
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _H2Protocol(asyncio.Protocol):
+    """A cleartext HTTP/2 (prior knowledge) server speaking just enough of the protocol for the stand-in."""
+
+    def __init__(self, stand_in: StandIn, delay_seconds: float):
+        import h2.config
+        import h2.connection
+
+        self.stand_in = stand_in
+        self.delay_seconds = delay_seconds
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        self.bodies: Dict[int, bytearray] = {}
+        self.outbound: Dict[int, bytes] = {}
+
+    def connection_made(self, transport):
+        self.stand_in.count_connection()
+        self.transport = transport
+        self.conn.initiate_connection()
+        self.transport.write(self.conn.data_to_send())
+
+    def data_received(self, data: bytes):
+        import h2.events
+
+        for event in self.conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                self.bodies[event.stream_id] = bytearray()
+            elif isinstance(event, h2.events.DataReceived):
+                self.bodies[event.stream_id] += event.data
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                asyncio.get_running_loop().call_later(self.delay_seconds, self._respond, event.stream_id)
+            elif isinstance(event, h2.events.WindowUpdated):
+                self._flush()
+        self.transport.write(self.conn.data_to_send())
+
+    def _respond(self, stream_id: int):
+        body = json.loads(bytes(self.bodies.pop(stream_id)))
+        payload = json.dumps(fake_response(body)).encode("utf-8")
+        self.conn.send_headers(stream_id, [
+            (":status", "200"),
+            ("content-type", "application/json"),
+            ("content-length", str(len(payload))),
+        ])
+        self.outbound[stream_id] = payload
+        self._flush()
+
+    def _flush(self):
+        """Sends as much of each pending response as flow control allows."""
+        for stream_id in list(self.outbound):
+            payload = self.outbound[stream_id]
+            while payload:
+                window = min(self.conn.local_flow_control_window(stream_id), self.conn.max_outbound_frame_size)
+                if window <= 0:
+                    break
+                chunk, payload = payload[:window], payload[window:]
+                self.conn.send_data(stream_id, chunk, end_stream=not payload)
+            if payload:
+                self.outbound[stream_id] = payload
+            else:
+                del self.outbound[stream_id]
+        self.transport.write(self.conn.data_to_send())
+
+
+@contextmanager
+def stand_in_h2_server(delay_seconds: float = 0.0) -> Generator[StandIn, None, None]:
+    """Serves the stand-in over cleartext HTTP/2 on a free local port for the duration of the block. Requires h2."""
+    stand_in = StandIn()
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        loop.create_server(lambda: _H2Protocol(stand_in, delay_seconds), "127.0.0.1", 0)
+    )
+    stand_in.url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1/embeddings"
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield stand_in
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
@@ -0,0 +1,62 @@
+"""Measures the plugin's cold start: import time, first request, and a warm follow-up request.
+
+Each sample runs in a fresh interpreter so that nothing is cached between samples. Run from the repository root:
+
+    PYTHONPATH=src python -m benchmarks.startup
+"""
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.stand_in import stand_in_server
+
+SAMPLES = 5
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from api import OpenAIEmbedderPlugin
+from openai.client import OpenAIEmbeddingClient
+imported = time.perf_counter()
+from steamship.plugin.inputs.block_and_tag_plugin_input import BlockAndTagPluginInput
+from steamship.plugin.request import PluginRequest
+from steamship import Block, File
+
+OpenAIEmbeddingClient.URL = sys.argv[1]
+request = PluginRequest(data=BlockAndTagPluginInput(file=File(id="f", blocks=[Block(id="b", text="hello world")])))
+
+def invoke():
+    before = time.perf_counter()
+    OpenAIEmbedderPlugin(config={"api_key": "benchmark", "prewarm": sys.argv[2] == "1"}).run(request)
+    return time.perf_counter() - before
+
+first = invoke()
+warm = invoke()
+print(json.dumps({"import": imported - start, "first_request": first, "warm_request": warm}))
+"""
+
+
+def _sample(url: str, prewarm: bool) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, url, "1" if prewarm else "0"],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    with stand_in_server() as stand_in:
+        for prewarm in (False, True):
+            samples = [_sample(stand_in.url, prewarm) for _ in range(SAMPLES)]
+            print(f"prewarm={prewarm}")
+            for key in ("import", "first_request", "warm_request"):
+                values = [sample[key] * 1000 for sample in samples]
+                print(f"  {key:<14} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    main()
+    print(f"total {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,49 @@
+"""Compares the HTTP/1.1 (aiohttp) and HTTP/2 (httpx) transports: connections opened and request latency.
+
+Embeds the same inputs through each transport against a local stand-in server of the matching protocol, which adds
+a fixed delay per request to stand in for model latency. Requires `httpx[http2]`. The stand-ins are cleartext, so
+the TLS handshakes HTTP/2 saves against the real API are not included. Run from the repository root:
+
+    PYTHONPATH=src python -m benchmarks.transport
+"""
+import statistics
+import time
+
+from benchmarks.stand_in import stand_in_h2_server, stand_in_server
+from openai.client import OpenAIEmbeddingClient
+from openai.dispatcher import Lane
+from openai.transport import AiohttpTransport, HttpxTransport
+
+MODEL = "text-embedding-ada-002"
+INPUTS = [f"sentence number {i} of a document being indexed" for i in range(240)]
+DELAY_SECONDS = 0.05
+ROUNDS = 5
+
+
+def _run(name: str, server, transport):
+    with server(delay_seconds=DELAY_SECONDS) as stand_in:
+        client = OpenAIEmbeddingClient(key="benchmark", transport=transport)
+        client.URL = stand_in.url
+        durations = []
+        for round_number in range(ROUNDS):
+            inputs = [f"{text} (round {round_number})" for text in INPUTS]
+            start = time.perf_counter()
+            client.request_matrix(MODEL, inputs, lane=Lane.BULK)
+            durations.append(time.perf_counter() - start)
+        transport.close()
+        metrics = transport.metrics.snapshot()
+        print(
+            f"{name:<16} connections {stand_in.connections:>4}   "
+            f"request median {statistics.median(durations) * 1000:7.1f} ms   "
+            f"attempt mean {metrics['mean_seconds'] * 1000:6.1f} ms   attempts {metrics['attempts']}"
+        )
+
+
+def main():
+    print(f"{ROUNDS} rounds of {len(INPUTS)} inputs in batches of {OpenAIEmbeddingClient.BATCH_SIZE}")
+    _run("HTTP/1.1 aiohttp", stand_in_server, AiohttpTransport())
+    _run("HTTP/2 httpx", stand_in_h2_server, HttpxTransport(http1=False, max_connections=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,34 @@
 """Steamship OpenAI Embeddings Client"""
-from typing import List, Optional, Type, Dict, Any
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Type, Dict, Any, Iterator, Tuple
 
 from pydantic import Field
 from steamship import Tag, Steamship, SteamshipError
 from steamship.invocable import Config, Invocable, InvocationContext
+from steamship.plugin.inputs.block_and_tag_plugin_input import BlockAndTagPluginInput
 from steamship.plugin.outputs.plugin_output import UsageReport
 from steamship.plugin.request import PluginRequest
 
-from openai.api_spec import validate_model
+from openai.api_spec import estimate_token_count, validate_model
 from openai.client import OpenAIEmbeddingClient
+from openai.dispatcher import Lane
+from openai.rate_limiter import RateLimits, rate_limiter_from_url
+from openai.transport import AiohttpTransport, HttpxTransport
 from tagger.span import Granularity, Span
+from tagger.near_duplicates import find_near_duplicates
 from tagger.span_tagger import SpanStreamingConfig, SpanTagger
 
 VALID_MODELS_FOR_BILLING = ["text-embedding-ada-002"]
 
+# Warm instances are reused across invocations, each of which constructs a new plugin. This process-level cache lets
+# every invocation after the first reuse the client, and with it the client's connections and in-flight requests. It
+# keeps the most recently used few, closing the sessions of the clients it evicts.
+MAX_CACHED_CLIENTS = 4
+_CLIENTS: "OrderedDict[Tuple, OpenAIEmbeddingClient]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
 class OpenAIEmbedderPlugin(SpanTagger, Invocable):
 
     class OpenAIEmbedderConfig(Config):
@@ -24,12 +39,23 @@ class OpenAIEmbedderPlugin(SpanTagger, Invocable):
         kind_filter: Optional[str] = Field("", description="Filter tags on kind")
         name_filter: Optional[str] = Field("", description="Filter tags on name")
         dimensionality: int = Field(None, description="Dimensionality of the embeddings")
+        near_duplicate_threshold: float = Field(0, description="Reuse the embedding of an earlier span whose text has at least this Jaccard similarity. 0 disables")
+        priority_lane: Optional[Lane] = Field(None, description="Dispatch lane (interactive or bulk). Chosen per request when empty")
+        rate_limiter: Optional[str] = Field("", description="Rate limit shared with other workers: memory://, file:///path or tcp://host:port")
+        requests_per_minute: Optional[float] = Field(None, description="Account request budget enforced by a memory:// or file:// rate limiter")
+        tokens_per_minute: Optional[float] = Field(None, description="Account token budget enforced by a memory:// or file:// rate limiter")
+        rate_limit_burst_seconds: float = Field(60, description="Seconds of budget a memory:// or file:// rate limiter lets through at once when idle")
+        http2: bool = Field(False, description="Multiplex the requests of concurrent invocations over HTTP/2 connections (requires httpx[http2])")
+        prewarm: bool = Field(False, description="Load the HTTP stack and open a connection to OpenAI when the plugin is first loaded")
+        background_span_threshold: int = Field(0, description="Embed in a background task when a request has more spans than this. 0 disables")
+        background_token_threshold: int = Field(0, description="Embed in a background task when a request has more estimated tokens than this. 0 disables")
 
         class Config:
             use_enum_values = False
 
     config: OpenAIEmbedderConfig
     client: OpenAIEmbeddingClient
+    lane: Lane
 
     def __init__(self,
         client: Steamship = None,
@@ -42,7 +68,42 @@ class OpenAIEmbedderPlugin(SpanTagger, Invocable):
         if original_api_key == "" and self.config.model not in VALID_MODELS_FOR_BILLING:
             raise SteamshipError(f"This plugin cannot be used with model {self.config.model} while using Steamship's API key. Valid models are {VALID_MODELS_FOR_BILLING}")
         validate_model(self.config.model)
-        self.client = OpenAIEmbeddingClient(key=self.config.api_key)
+        self.client = self._cached_client(self.config)
+        self.lane = self.config.priority_lane or Lane.BULK
+
+    @staticmethod
+    def _cached_client(config: OpenAIEmbedderConfig) -> OpenAIEmbeddingClient:
+        """Returns the process-wide client for these connection settings, creating (and optionally pre-warming) it
+        on first use."""
+        key = (
+            config.api_key, config.rate_limiter, config.requests_per_minute, config.tokens_per_minute,
+            config.rate_limit_burst_seconds, config.http2,
+        )
+        with _CACHE_LOCK:
+            client = _CLIENTS.get(key)
+            if client is not None:
+                _CLIENTS.move_to_end(key)
+                return client
+            client = OpenAIEmbeddingClient(
+                key=config.api_key,
+                rate_limiter=rate_limiter_from_url(
+                    config.rate_limiter,
+                    RateLimits(
+                        requests_per_minute=config.requests_per_minute,
+                        tokens_per_minute=config.tokens_per_minute,
+                        burst_seconds=config.rate_limit_burst_seconds,
+                    ),
+                ),
+                transport=HttpxTransport() if config.http2 else AiohttpTransport(),
+            )
+            _CLIENTS[key] = client
+            evicted = [_CLIENTS.popitem(last=False)[1] for _ in range(len(_CLIENTS) - MAX_CACHED_CLIENTS)]
+        for stale in evicted:
+            # Each cached client has a transport of its own, so closing it cannot affect another client.
+            stale.transport.close()
+        if config.prewarm:
+            threading.Thread(target=client.prewarm, daemon=True).start()
+        return client
 
     @classmethod
     def config_cls(cls) -> Type[Config]:
@@ -55,11 +116,73 @@ class OpenAIEmbedderPlugin(SpanTagger, Invocable):
             name_filter=self.config.name_filter
         )
 
+    def run(self, request: PluginRequest[BlockAndTagPluginInput]):
+        self.lane = self._choose_lane(request)
+        return super().run(request)
+
+    def _choose_lane(self, request: PluginRequest[BlockAndTagPluginInput]) -> Lane:
+        """Queries arrive as files with a single block of text; anything larger is treated as bulk indexing."""
+        if self.config.priority_lane is not None:
+            return self.config.priority_lane
+        file = request.data.file if request.data else None
+        text_blocks = [block for block in (file.blocks if file else None) or [] if block.text]
+        return Lane.INTERACTIVE if len(text_blocks) <= 1 else Lane.BULK
+
+    def should_run_in_background(self, spans: List[Span]) -> bool:
+        span_threshold = self.config.background_span_threshold
+        if span_threshold and len(spans) > span_threshold:
+            return True
+        token_threshold = self.config.background_token_threshold
+        if token_threshold and sum(estimate_token_count(span.text) for span in spans) > token_threshold:
+            return True
+        return False
+
+    def find_reusable_spans(self, spans: List[Span]) -> Dict[int, Tuple[int, float]]:
+        if not self.config.near_duplicate_threshold:
+            return {}
+        return find_near_duplicates([span.text for span in spans], self.config.near_duplicate_threshold)
+
+    def stream(self, request: PluginRequest[BlockAndTagPluginInput]) -> Iterator[str]:
+        """Embeds the request's spans, yielding NDJSON lines as each batch of embeddings completes.
+
+        Each span yields a line with its `block_id`, `start_idx`, `end_idx` and `vector`, in completion order rather
+        than file order. A final line carries the `usage` reports. Lets an indexer write vectors while later batches
+        are still in flight, instead of waiting for the whole file as with `run`.
+        """
+        args = self.get_span_streaming_args()
+        spans = [
+            span for span in Span.stream_from(
+                file=request.data.file,
+                granularity=args.granularity,
+                kind_filter=args.kind_filter,
+                name_filter=args.name_filter
+            )
+            if span.text.strip()
+        ]
+        usage_reports = []
+        batches = self.client.iter_embeddings(
+            model=self.config.model,
+            inputs=[span.text for span in spans],
+            lane=self._choose_lane(request),
+        )
+        for batch in batches:
+            usage_reports.append(batch.usage)
+            for i in range(batch.embeddings.rows):
+                span = spans[batch.offset + i]
+                yield json.dumps({
+                    "block_id": span.block_id,
+                    "start_idx": span.start_idx,
+                    "end_idx": span.end_idx,
+                    "vector": batch.embeddings.row(i).tolist(),
+                }) + "\n"
+        yield json.dumps({"usage": [json.loads(report.json(by_alias=True)) for report in usage_reports]}) + "\n"
+
     def tag_span(self, request: PluginRequest[Span]) -> (List[Tag], Optional[List[UsageReport]]):
         if request.data.text.strip():
             tags_lists, usage = self.client.request(
                 model=self.config.model,
                 inputs=[request.data.text],
+                lane=self.lane,
             )
             tags = tags_lists[0] or []
             return tags, usage
@@ -1,4 +1,5 @@
 """Collection of object specifications used to communicate with the NLPCloud API."""
+import math
 
 from steamship import SteamshipError
 
@@ -34,3 +35,12 @@ def validate_model(model: str):
             message=f"Model {model} is not supported by this plugin.. " +
                     f"Valid models for this task are: {[m for m in MODEL_TO_DIMENSIONALITY]}."
         )
+
+
+# OpenAI's rule of thumb for English text: one token is roughly four characters.
+CHARACTERS_PER_TOKEN = 4
+
+
+def estimate_token_count(text: str) -> int:
+    """Cheap approximation of the number of tokens OpenAI will bill for `text`."""
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
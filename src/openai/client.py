@@ -1,15 +1,40 @@
+from array import array
+from concurrent.futures import CancelledError
+from contextlib import closing
 from enum import Enum
-from typing import List
+from typing import Dict, Iterator, List, Optional
 
 from pydantic import BaseModel
+from steamship import SteamshipError
 from steamship.data import TagKind, TagValueKey
 from steamship.data.tags import Tag
 
-from openai.api_spec import validate_model
-from openai.request_utils import concurrent_json_posts
+from openai.api_spec import MODEL_TO_DIMENSIONALITY, estimate_token_count, validate_model
+from openai.dispatcher import Lane, PriorityDispatcher
+from openai.matrix import FLOAT32_BYTES, EmbeddingMatrix, decode_embedding
+from openai.rate_limiter import RateLimiter
+from openai.request_utils import iter_json_posts, prewarm
+from openai.single_flight import SingleFlight, flight_key, unique
+from openai.transport import Transport, default_transport
 from steamship.plugin.outputs.plugin_output import UsageReport, OperationType, OperationUnit
 
 
+def embedding_tag(model: str, vector: List[float]) -> Tag:
+    return Tag(
+        kind=TagKind.EMBEDDING,
+        name=model,
+        value={
+            "service": "openai",
+            TagValueKey.VECTOR_VALUE: vector
+        },
+    )
+
+
+def embedding_tags(model: str, matrix: EmbeddingMatrix) -> List[Tag]:
+    """One embedding `Tag` per row of `matrix`."""
+    return [embedding_tag(model, matrix.row(i).tolist()) for i in range(matrix.rows)]
+
+
 class OpenAIObject(str, Enum):
     LIST = 'list'
     EMBEDDING = 'embedding'
@@ -21,58 +46,205 @@ class OpenAIEmbedding(BaseModel):
     embedding: List[float]
 
     def to_tag(self, model: str) -> Tag:
-        return Tag(
-            kind=TagKind.EMBEDDING,
-            name=model,
-            value={
-                "service": "openai",
-                TagValueKey.VECTOR_VALUE: self.embedding
-            },
-        )
+        return embedding_tag(model, self.embedding)
 
 
 class OpenAIEmbeddingList(BaseModel):
     object: OpenAIObject  # 'list'
     data: List[OpenAIEmbedding]
 
+    def to_matrix(self) -> EmbeddingMatrix:
+        """The embeddings as one float32 matrix, one row per element of `data`."""
+        dim = len(self.data[0].embedding) if self.data else 0
+        data = array("f")
+        for embedding in self.data:
+            if len(embedding.embedding) != dim:
+                raise ValueError(f"Expected embeddings of {dim} dimensions, got {len(embedding.embedding)}")
+            data.extend(embedding.embedding)
+        return EmbeddingMatrix(data, len(self.data), dim)
+
     def to_tags(self, model: str) -> List[Tag]:
-        return [embedding.to_tag(model) for embedding in self.data]
+        return embedding_tags(model, self.to_matrix())
+
+
+class EmbeddingBatch(BaseModel):
+    """The embeddings of one completed batch of inputs, starting at `offset` within the request's inputs."""
+    offset: int
+    embeddings: EmbeddingMatrix
+    usage: UsageReport
+
+    class Config:
+        arbitrary_types_allowed = True
 
 
 class OpenAIEmbeddingClient:
     URL = "https://api.openai.com/v1/embeddings"
-
-    def __init__(self, key: str):
+    BATCH_SIZE = 6
+
+    def __init__(
+            self,
+            key: str,
+            dispatcher: Optional[PriorityDispatcher] = None,
+            rate_limiter: Optional[RateLimiter] = None,
+            transport: Optional[Transport] = None,
+    ):
         self.key = key
+        self.dispatcher = dispatcher or PriorityDispatcher()
+        self.rate_limiter = rate_limiter
+        self.transport = transport or default_transport()
+        self.single_flight = SingleFlight()
+
+    def _resolve_lane(self, inputs: List[str], lane: Optional[Lane]) -> Lane:
+        """`lane`, or by default interactive for requests that fit in a single batch and bulk for larger ones."""
+        if lane is not None:
+            return lane
+        return Lane.INTERACTIVE if len(inputs) <= self.BATCH_SIZE else Lane.BULK
+
+    def _headers(self) -> Dict:
+        return {
+            "Authorization": f"Bearer {self.key}",
+            "Content-Type": "application/json",
+        }
 
-    def request(
-            self, model: str, inputs: List[str], **kwargs
-    ) -> (List[List[Tag]], List[UsageReport]):
-        """Performs an OpenAI request. Throw a SteamshipError in the event of error or empty response."""
+    def prewarm(self):
+        """Loads the HTTP stack and opens this client's session and a connection to OpenAI ahead of its first
+        request."""
+        prewarm(self.URL, self.transport, self._headers())
 
+    def _post_args(
+            self, model: str, inputs: List[str], lane: Lane, encoding_format: Optional[str] = None
+    ) -> tuple:
+        """The positional arguments of `iter_json_posts`."""
         validate_model(model)
 
-        headers = {
-            "Authorization": f"Bearer {self.key}",
-            "Content-Type": "application/json",
-        }
+        headers = self._headers()
 
         def items_to_body(items: List[str]):
-            return {
+            body = {
                 "model": model,
                 "input": items
             }
+            if encoding_format is not None:
+                body["encoding_format"] = encoding_format
+            return body
 
-        responses = concurrent_json_posts(self.URL, headers, inputs, 6, items_to_body, "openai")
-        usage_reports: List[UsageReport] = []
-        tag_lists: List[List[Tag]] = []
-        for response in responses:
-            obj = OpenAIEmbeddingList.parse_obj(response)
-            for embedding in obj.data:
-                tag_lists.append([embedding.to_tag(model=model)])
-            usage_reports.append(UsageReport(
-                operation_unit=OperationUnit.PROMPT_TOKENS,
-                operation_type=OperationType.RUN,
-                operation_amount=response["usage"]["prompt_tokens"]
-            ))
+        def items_to_tokens(items: List[str]):
+            return sum(estimate_token_count(item) for item in items)
+
+        return (
+            self.URL, headers, inputs, self.BATCH_SIZE, items_to_body, "openai",
+            self.dispatcher, lane, self.rate_limiter, items_to_tokens, self.transport
+        )
+
+    @staticmethod
+    def _decode_rows(response: Dict) -> List[bytes]:
+        """The raw float32 rows of a base64-encoded response, in input order."""
+        return [
+            decode_embedding(embedding["embedding"])
+            for embedding in sorted(response["data"], key=lambda e: e["index"])
+        ]
+
+    @staticmethod
+    def _usage_report(response: Dict) -> UsageReport:
+        return UsageReport(
+            operation_unit=OperationUnit.PROMPT_TOKENS,
+            operation_type=OperationType.RUN,
+            operation_amount=response["usage"]["prompt_tokens"]
+        )
+
+    def request(
+            self, model: str, inputs: List[str], lane: Optional[Lane] = None, **kwargs
+    ) -> (List[List[Tag]], List[UsageReport]):
+        """Performs an OpenAI request. Throw a SteamshipError in the event of error or empty response.
+
+        A thin layer over `request_matrix` that wraps each row in an embedding `Tag`.
+        """
+        matrix, usage_reports = self.request_matrix(model, inputs, lane)
+        tag_lists = [[tag] for tag in embedding_tags(model, matrix)]
         return tag_lists, usage_reports
+
+    def request_matrix(
+            self, model: str, inputs: List[str], lane: Optional[Lane] = None
+    ) -> (EmbeddingMatrix, List[UsageReport]):
+        """Embeds `inputs` into one contiguous float32 matrix of shape (len(inputs), dim), in input order.
+
+        Requests go through the client's dispatcher in the given `lane`. By default, requests that fit in a single
+        batch are treated as interactive and larger ones as bulk.
+
+        Each distinct text is sent once, and texts already in flight in the same lane for a concurrent caller of this
+        client are awaited rather than sent again. Usage is reported only for the texts this call sent.
+        """
+        validate_model(model)
+        lane = self._resolve_lane(inputs, lane)
+        keys = [flight_key(model, text, lane) for text in inputs]
+        texts = dict(zip(keys, inputs))
+
+        rows: Dict = {}
+        usage_reports: List[UsageReport] = []
+        pending = unique(keys)
+        while pending:
+            leading, following = self.single_flight.claim(pending)
+            if leading:
+                rows.update(self._lead(model, leading, texts, lane, usage_reports))
+
+            pending = []
+            for key, future in following.items():
+                try:
+                    rows[key] = future.result()
+                except CancelledError:
+                    # The leader was interrupted; claim the text again.
+                    pending.append(key)
+
+        dim = len(rows[keys[0]]) // FLOAT32_BYTES if keys else MODEL_TO_DIMENSIONALITY[model]
+        return EmbeddingMatrix.from_rows([rows[key] for key in keys], dim), usage_reports
+
+    def _lead(
+            self, model: str, leading: Dict, texts: Dict, lane: Lane, usage_reports: List[UsageReport]
+    ) -> Dict:
+        """Sends the texts this caller leads, resolving each batch's futures as soon as that batch completes."""
+        leading_keys = list(leading)
+        unresolved = dict(leading)
+        rows = {}
+        try:
+            posts = iter_json_posts(
+                *self._post_args(model, [texts[key] for key in leading_keys], lane, encoding_format="base64")
+            )
+            with closing(posts) as batches:
+                for offset, response in batches:
+                    batch_keys = leading_keys[offset:offset + self.BATCH_SIZE]
+                    batch_rows = self._decode_rows(response)
+                    if len(batch_rows) != len(batch_keys):
+                        raise SteamshipError(
+                            message=f"OpenAI returned {len(batch_rows)} embeddings for {len(batch_keys)} inputs."
+                        )
+                    usage_reports.append(self._usage_report(response))
+                    batch_results = dict(zip(batch_keys, batch_rows))
+                    completed = {key: unresolved.pop(key) for key in batch_keys}
+                    self.single_flight.complete(completed, batch_results)
+                    rows.update(batch_results)
+        except Exception as e:
+            self.single_flight.fail(unresolved, e)
+            raise
+        except BaseException:
+            self.single_flight.abandon(unresolved)
+            raise
+        return rows
+
+    def iter_embeddings(
+            self, model: str, inputs: List[str], lane: Optional[Lane] = None
+    ) -> Iterator[EmbeddingBatch]:
+        """Yields the embeddings of each batch of `inputs` as soon as that batch completes.
+
+        Batches arrive in completion order, not input order; `EmbeddingBatch.offset` locates each one within
+        `inputs`. Lets callers start consuming vectors while later batches are still in flight. Like
+        `request_matrix`, vectors are fetched base64-encoded and decoded straight into float32 rows.
+        """
+        lane = self._resolve_lane(inputs, lane)
+        for offset, response in iter_json_posts(*self._post_args(model, inputs, lane, encoding_format="base64")):
+            rows = self._decode_rows(response)
+            dim = len(rows[0]) // FLOAT32_BYTES if rows else MODEL_TO_DIMENSIONALITY[model]
+            yield EmbeddingBatch(
+                offset=offset,
+                embeddings=EmbeddingMatrix.from_rows(rows, dim),
+                usage=self._usage_report(response),
+            )
@@ -0,0 +1,131 @@
+"""Priority-aware admission of requests to the OpenAI API.
+
+One deployment serves both one-sentence query embeddings and bulk ingestion of large files. Without coordination a
+query can queue behind every batch (and every retry) of a document. The `PriorityDispatcher` admits each HTTP
+attempt through one of two lanes:
+
+- `Lane.INTERACTIVE` may use any free slot, and is always admitted before waiting bulk requests.
+- `Lane.BULK` may use at most `bulk_concurrency` slots, so some capacity is always left for interactive requests.
+
+Each lane may also be paced to its own share of requests per minute.
+
+Synchronous posts all run on the transports' one shared event loop thread, but callers may also post from event
+loops of their own, so the dispatcher is guarded by a `threading.Lock` and wakes waiters on whichever loop they are
+parked on.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+
+class Lane(str, Enum):
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+
+
+class _RequestPacer:
+    """Spaces requests evenly to stay under a requests-per-minute budget."""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Reserves the next send time and returns how long to wait for it."""
+        with self.lock:
+            now = time.monotonic()
+            send_time = max(now, self.next_time)
+            self.next_time = send_time + self.interval
+            return send_time - now
+
+
+_Waiter = Tuple[asyncio.AbstractEventLoop, asyncio.Future]
+
+
+class PriorityDispatcher:
+    """Admits requests through an interactive and a bulk lane with separate concurrency and rate shares."""
+
+    def __init__(
+            self,
+            max_concurrency: int = 16,
+            bulk_concurrency: int = 12,
+            requests_per_minute: Optional[Dict[Lane, float]] = None,
+    ):
+        if not 0 < bulk_concurrency <= max_concurrency:
+            raise ValueError("bulk_concurrency must be between 1 and max_concurrency")
+        self.max_concurrency = max_concurrency
+        self._limits = {Lane.INTERACTIVE: max_concurrency, Lane.BULK: bulk_concurrency}
+        self._pacers = {
+            lane: _RequestPacer(rpm) for lane, rpm in (requests_per_minute or {}).items() if rpm
+        }
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Lane, int] = {lane: 0 for lane in Lane}
+        self._waiters: Dict[Lane, Deque[_Waiter]] = {lane: deque() for lane in Lane}
+
+    def in_flight(self, lane: Lane) -> int:
+        with self._lock:
+            return self._in_flight[lane]
+
+    def _can_start(self, lane: Lane) -> bool:
+        if sum(self._in_flight.values()) >= self.max_concurrency:
+            return False
+        if self._in_flight[lane] >= self._limits[lane]:
+            return False
+        if lane == Lane.BULK and self._waiters[Lane.INTERACTIVE]:
+            return False
+        return True
+
+    def _wake(self):
+        for lane in (Lane.INTERACTIVE, Lane.BULK):
+            while self._waiters[lane] and self._can_start(lane):
+                loop, future = self._waiters[lane].popleft()
+                self._in_flight[lane] += 1
+                loop.call_soon_threadsafe(_grant, future)
+
+    async def acquire(self, lane: Lane):
+        pacer = self._pacers.get(lane)
+        if pacer is not None:
+            await asyncio.sleep(pacer.reserve())
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters[lane] and self._can_start(lane):
+                self._in_flight[lane] += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters[lane].append(waiter)
+
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters[lane]:
+                    self._waiters[lane].remove(waiter)
+                else:
+                    # The slot was granted before the cancellation landed; hand it on.
+                    self._in_flight[lane] -= 1
+                    self._wake()
+            raise
+
+    def release(self, lane: Lane):
+        with self._lock:
+            self._in_flight[lane] -= 1
+            self._wake()
+
+    @asynccontextmanager
+    async def slot(self, lane: Lane) -> AsyncIterator[None]:
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
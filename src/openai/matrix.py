@@ -0,0 +1,62 @@
+"""A contiguous float32 matrix of embeddings.
+
+Building a `Tag` and a list of Python floats per embedding is wasteful for callers who only want the raw vectors,
+e.g. to feed an ANN index builder. `EmbeddingMatrix` keeps every vector of a request in one row-major float32
+buffer, filled directly from OpenAI's base64-encoded response bytes.
+
+NumPy is not a dependency of this plugin; `EmbeddingMatrix.to_numpy` imports it only when called and returns a
+zero-copy view of the buffer.
+"""
+import base64
+import sys
+from array import array
+from typing import List, Tuple
+
+FLOAT32_BYTES = 4
+
+
+def decode_embedding(encoded: str) -> bytes:
+    """The raw float32 bytes of a base64-encoded embedding, in native byte order."""
+    raw = base64.b64decode(encoded)
+    if sys.byteorder == "big":
+        swapped = array("f", raw)
+        swapped.byteswap()
+        raw = swapped.tobytes()
+    return raw
+
+
+class EmbeddingMatrix:
+    """Embeddings as one row-major float32 buffer of shape (rows, dim), one row per input."""
+
+    def __init__(self, data: array, rows: int, dim: int):
+        if data.typecode != "f" or len(data) != rows * dim:
+            raise ValueError(f"Expected {rows * dim} float32 values, got {len(data)} of type {data.typecode}")
+        self.data = data
+        self.rows = rows
+        self.dim = dim
+
+    @classmethod
+    def from_rows(cls, rows: List[bytes], dim: int) -> "EmbeddingMatrix":
+        """Concatenates raw float32 rows, each `dim` values long."""
+        for row in rows:
+            if len(row) != dim * FLOAT32_BYTES:
+                raise ValueError(f"Expected embeddings of {dim} dimensions, got {len(row) // FLOAT32_BYTES}")
+        data = array("f")
+        data.frombytes(b"".join(rows))
+        return cls(data, len(rows), dim)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.rows, self.dim
+
+    def row(self, i: int) -> array:
+        return self.data[i * self.dim:(i + 1) * self.dim]
+
+    def tolist(self) -> List[List[float]]:
+        return [self.row(i).tolist() for i in range(self.rows)]
+
+    def to_numpy(self):
+        """A (rows, dim) float32 `numpy.ndarray` sharing this matrix's memory. Requires NumPy."""
+        import numpy as np
+
+        return np.frombuffer(self.data, dtype=np.float32).reshape(self.rows, self.dim)
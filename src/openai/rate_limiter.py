@@ -0,0 +1,273 @@
+"""Rate limiting shared between every process that sends requests on the same OpenAI account.
+
+Each worker process has its own `OpenAIEmbeddingClient`, and none of them knows what the others send. Left alone they
+overshoot the account's limits together and then all back off at once. A `RateLimiter` gives them one shared budget
+of requests and tokens per minute, which each client draws from before every HTTP attempt.
+
+Budgets are kept as token buckets in the GCRA ("virtual scheduling") form: each bucket stores only the theoretical
+arrival time of the next unit, so a reservation is a single read-modify-write and always succeeds, returning how
+long the caller has to wait before sending.
+
+Reservations are first come, first served, so on their own an interactive query would wait behind every bulk batch
+already reserved. Interactive reservations therefore only wait on a bucket of their own, refilled at
+`interactive_share` of the budget, while still counting against the shared bucket so that later bulk reservations
+wait for them. Their sends may briefly exceed the budget by at most that share; the client's retries cover the rare
+rejection.
+
+Backends differ only in where the state lives:
+
+- `InProcessRateLimiter` keeps it in memory, for a single process.
+- `FileRateLimiter` keeps it in a locked file, for every process on one host.
+- `NetworkRateLimiter` asks a `RateLimitServer` over a line-delimited JSON protocol, for processes on many hosts.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from pydantic import BaseModel
+from steamship import SteamshipError
+
+from openai.dispatcher import Lane
+
+
+class RateLimits(BaseModel):
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    # How much of the budget may be spent in a burst, expressed as seconds of steady-state rate. OpenAI's limits are
+    # per minute, so by default an idle limiter lets a whole minute's budget through at once.
+    burst_seconds: float = 60.0
+    # The share of the budget interactive reservations may use without waiting behind bulk ones. 0 makes them queue
+    # with bulk reservations.
+    interactive_share: float = 0.2
+
+
+def reserve(
+        state: Dict[str, float],
+        limits: RateLimits,
+        requests: int,
+        tokens: int,
+        now: float,
+        lane: Lane = Lane.BULK,
+) -> float:
+    """Reserves budget against `state` (updated in place) and returns the seconds to wait before sending."""
+    interactive = lane == Lane.INTERACTIVE and limits.interactive_share > 0
+    wait = 0.0
+    for bucket, per_minute, amount in (
+            ("requests", limits.requests_per_minute, requests),
+            ("tokens", limits.tokens_per_minute, tokens),
+    ):
+        if not per_minute or not amount:
+            continue
+        per_second = per_minute / 60.0
+        theoretical_arrival = max(state.get(bucket, 0.0), now) + amount / per_second
+        state[bucket] = theoretical_arrival
+        if interactive:
+            bucket = f"{Lane.INTERACTIVE.value}_{bucket}"
+            per_second *= limits.interactive_share
+            theoretical_arrival = max(state.get(bucket, 0.0), now) + amount / per_second
+            state[bucket] = theoretical_arrival
+        wait = max(wait, theoretical_arrival - limits.burst_seconds - now)
+    return wait
+
+
+class RateLimiter(ABC):
+    """A request and token budget shared between clients."""
+
+    @abstractmethod
+    def reserve(self, requests: int, tokens: int, lane: Lane = Lane.BULK) -> float:
+        """Reserves budget for a request in `lane` and returns the seconds to wait before sending it."""
+        raise NotImplementedError()
+
+    async def acquire(self, requests: int, tokens: int, lane: Lane = Lane.BULK):
+        """Reserves budget without blocking the event loop, then waits until the request may be sent."""
+        wait = await asyncio.get_running_loop().run_in_executor(None, self.reserve, requests, tokens, lane)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class InProcessRateLimiter(RateLimiter):
+    def __init__(self, limits: RateLimits):
+        self.limits = limits
+        self._state: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, requests: int, tokens: int, lane: Lane = Lane.BULK) -> float:
+        with self._lock:
+            return reserve(self._state, self.limits, requests, tokens, time.time(), lane)
+
+
+class FileRateLimiter(RateLimiter):
+    """Keeps the bucket state in a file guarded by `flock`, shared by every process on the host."""
+
+    def __init__(self, path: str, limits: RateLimits):
+        self.path = path
+        self.limits = limits
+
+    def reserve(self, requests: int, tokens: int, lane: Lane = Lane.BULK) -> float:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 4096, 0)
+            state = json.loads(raw) if raw else {}
+            wait = reserve(state, self.limits, requests, tokens, time.time(), lane)
+            encoded = json.dumps(state).encode("utf-8")
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, encoded, 0)
+            return wait
+        finally:
+            os.close(fd)  # Also releases the lock.
+
+
+class NetworkRateLimiter(RateLimiter):
+    """Reserves budget from a `RateLimitServer`.
+
+    If the server cannot be reached, the request is sent without waiting: the limiter is an optimization, and the
+    client's retries still protect against overshooting the account's limits. After a failure the server is skipped
+    for a backoff period, doubling while it stays down, so a dead or hung server costs one short timeout per period
+    rather than one per request. Reservations run on pooled connections, so concurrent callers never queue behind
+    each other's network round trips.
+    """
+
+    TIMEOUT_SECONDS = 0.25
+    BACKOFF_SECONDS = 1.0
+    MAX_BACKOFF_SECONDS = 30.0
+
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self._lock = threading.Lock()
+        self._idle: List[Tuple[socket.socket, BinaryIO]] = []
+        self._retry_at = 0.0
+        self._backoff = self.BACKOFF_SECONDS
+
+    def _connect(self) -> Tuple[socket.socket, BinaryIO]:
+        sock = socket.create_connection(self.address, timeout=self.TIMEOUT_SECONDS)
+        return sock, sock.makefile("rwb")
+
+    @staticmethod
+    def _exchange(connection: Tuple[socket.socket, BinaryIO], message: bytes) -> float:
+        stream = connection[1]
+        stream.write(message)
+        stream.flush()
+        reply = stream.readline()
+        if not reply:
+            raise ConnectionError("Rate limit server closed the connection")
+        return float(json.loads(reply)["wait"])
+
+    def reserve(self, requests: int, tokens: int, lane: Lane = Lane.BULK) -> float:
+        message = json.dumps({"requests": requests, "tokens": tokens, "lane": lane.value}).encode("utf-8") + b"\n"
+        with self._lock:
+            if time.monotonic() < self._retry_at:
+                return 0.0
+            pooled = self._idle.pop() if self._idle else None
+        if pooled is not None:
+            try:
+                return self._release(pooled, self._exchange(pooled, message))
+            except socket.timeout as e:
+                self._discard(pooled)
+                return self._trip(e)
+            except (OSError, ValueError, KeyError):
+                # The server may simply have dropped the connection while it sat idle; try a fresh one.
+                self._discard(pooled)
+        connection = None
+        try:
+            connection = self._connect()
+            return self._release(connection, self._exchange(connection, message))
+        except (OSError, ValueError, KeyError) as e:
+            if connection is not None:
+                self._discard(connection)
+            return self._trip(e)
+
+    def _release(self, connection: Tuple[socket.socket, BinaryIO], wait: float) -> float:
+        with self._lock:
+            self._idle.append(connection)
+            self._backoff = self.BACKOFF_SECONDS
+        return wait
+
+    def _trip(self, error: Exception) -> float:
+        with self._lock:
+            backoff = self._backoff
+            self._retry_at = time.monotonic() + backoff
+            self._backoff = min(backoff * 2, self.MAX_BACKOFF_SECONDS)
+        logging.warning(f"Rate limit server {self.address} unavailable; not waiting for {backoff:g}s. {error}")
+        return 0.0
+
+    @staticmethod
+    def _discard(connection: Tuple[socket.socket, BinaryIO]):
+        for closeable in reversed(connection):
+            try:
+                closeable.close()
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
+
+
+class _ReserveHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line)
+            wait = self.server.limiter.reserve(
+                int(request.get("requests", 0)),
+                int(request.get("tokens", 0)),
+                Lane(request.get("lane", Lane.BULK.value)),
+            )
+            self.wfile.write(json.dumps({"wait": wait}).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class RateLimitServer(socketserver.ThreadingTCPServer):
+    """Serves `NetworkRateLimiter` reservations from an in-process bucket.
+
+    Run one per account, for example::
+
+        python -m openai.rate_limiter 0.0.0.0 7437 3000 1000000 [burst seconds]
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str, port: int, limits: RateLimits):
+        super().__init__((host, port), _ReserveHandler)
+        self.limiter = InProcessRateLimiter(limits)
+
+
+def rate_limiter_from_url(url: Optional[str], limits: RateLimits) -> Optional[RateLimiter]:
+    """Builds a limiter from `memory://`, `file:///path/to/state`, or `tcp://host:port`. Empty means no limiter."""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return InProcessRateLimiter(limits)
+    if parsed.scheme == "file":
+        return FileRateLimiter(parsed.path, limits)
+    if parsed.scheme == "tcp":
+        return NetworkRateLimiter(parsed.hostname, parsed.port)
+    raise SteamshipError(
+        message=f"Unsupported rate limiter {url}. Use memory://, file:///path or tcp://host:port."
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    host, port, requests_per_minute, tokens_per_minute = sys.argv[1:5]
+    limits = RateLimits(requests_per_minute=float(requests_per_minute), tokens_per_minute=float(tokens_per_minute))
+    if len(sys.argv) > 5:
+        limits.burst_seconds = float(sys.argv[5])
+    server = RateLimitServer(host, int(port), limits)
+    logging.info(f"Serving rate limits on {host}:{port}")
+    server.serve_forever()
@@ -1,22 +1,75 @@
 import asyncio
 import json
 import logging
+import queue
+import socket
+import time
 from asyncio import Task
-from typing import Any, Callable, Dict, List
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 
-import aiohttp
 from steamship import SteamshipError
-from tenacity import (
-    after_log,
-    before_sleep_log,
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential_jitter,
-)
 
+from openai.dispatcher import Lane, PriorityDispatcher
+from openai.rate_limiter import RateLimiter
+from openai.transport import Transport, TransportSession, default_transport
 
-async def _json_post(session: aiohttp.ClientSession, url: str, body: Dict, service_name: str) -> Task:
+PREWARM_TIMEOUT_SECONDS = 10.0
+
+# aiohttp and tenacity are imported where they are used: together they are a sizeable share of the plugin's cold
+# start, and invocations that never reach the network (validation errors, status checks) should not pay for them.
+
+
+def prewarm(url: str, transport: Optional[Transport] = None, headers: Optional[Dict] = None):
+    """Imports the HTTP stack and resolves the host of `url` ahead of the first request.
+
+    Given the `headers` later requests will send, also opens their shared session and a connection to the host, so
+    that the first request skips the TCP and TLS handshakes too.
+    """
+    import tenacity  # noqa: F401
+
+    transport = transport or default_transport()
+    transport.preload()
+
+    parsed = urlparse(url)
+    try:
+        socket.getaddrinfo(parsed.hostname, parsed.port or 443)
+    except OSError as e:
+        logging.info(f"Unable to resolve {parsed.hostname} while pre-warming: {e}")
+        return
+
+    if headers is not None:
+        try:
+            transport.run(asyncio.wait_for(_open_connection(transport, url, headers), PREWARM_TIMEOUT_SECONDS))
+        except (ConnectionError, asyncio.TimeoutError, SteamshipError) as e:
+            logging.info(f"Unable to connect to {parsed.hostname} while pre-warming: {e}")
+
+
+async def _open_connection(transport: Transport, url: str, headers: Dict):
+    async with transport.borrow_session(headers) as session:
+        await session.connect(url)
+
+
+async def _json_post(
+        transport: Transport,
+        session: TransportSession,
+        url: str,
+        body: Dict,
+        service_name: str,
+        dispatcher: Optional[PriorityDispatcher] = None,
+        lane: Lane = Lane.BULK,
+        rate_limiter: Optional[RateLimiter] = None,
+        tokens: int = 0,
+) -> Task:
+    from tenacity import (
+        after_log,
+        before_sleep_log,
+        retry,
+        retry_if_exception_type,
+        stop_after_attempt,
+        wait_exponential_jitter,
+    )
 
     @retry(
         reraise=True,
@@ -29,18 +82,43 @@ async def _json_post(session: aiohttp.ClientSession, url: str, body: Dict, servi
         after=after_log(logging.root, logging.INFO),
     )
     async def _inner_json_post():
-        async with session.post(url, data=json.dumps(body)) as resp:
-            if not resp.ok:
+        # Every attempt is billed against the account's limits, so each one draws from the shared budget. The lane
+        # lets interactive attempts skip the budget already reserved by queued bulk ones.
+        if rate_limiter is not None:
+            await rate_limiter.acquire(requests=1, tokens=tokens, lane=lane)
+        # Each attempt takes its own slot, so a request backing off between retries does not hold one.
+        async with dispatcher.slot(lane) if dispatcher is not None else nullcontext():
+            started = time.perf_counter()
+            try:
+                resp = await asyncio.wait_for(session.post(url, json.dumps(body)), transport.timeout_seconds)
+            except asyncio.TimeoutError:
+                transport.metrics.record(ok=False, seconds=time.perf_counter() - started, timed_out=True)
                 raise SteamshipError(
-                    message=f"Request to {service_name} failed. URL={url}, Code={resp.status}. Body={await resp.text()}"
+                    message=f"Request to {service_name} timed out after {transport.timeout_seconds}s. URL={url}"
                 )
+            except ConnectionError as e:
+                # Includes kept-alive connections the server closed since their last use; retried like a failure.
+                transport.metrics.record(ok=False, seconds=time.perf_counter() - started)
+                raise SteamshipError(message=f"Connection to {service_name} failed: {e}. URL={url}", error=e)
+            except Exception:
+                transport.metrics.record(ok=False, seconds=time.perf_counter() - started)
+                raise
+            transport.metrics.record(ok=resp.ok, seconds=time.perf_counter() - started)
 
-            output = await resp.json()
-            if not output:
-                raise SteamshipError(
-                    message=f"Request from {service_name} could not be interpreted as JSON. URL={url}"
-                )
-            return output
+        if not resp.ok:
+            raise SteamshipError(
+                message=f"Request to {service_name} failed. URL={url}, Code={resp.status}. Body={resp.text}"
+            )
+
+        try:
+            output = json.loads(resp.text)
+        except ValueError:
+            output = None
+        if not output:
+            raise SteamshipError(
+                message=f"Request from {service_name} could not be interpreted as JSON. URL={url}"
+            )
+        return output
 
     result = await _inner_json_post()
     logging.info("Retry statistics: " + json.dumps(_inner_json_post.retry.statistics))
@@ -60,19 +138,32 @@ async def async_concurrent_json_posts(
         items: List[Any],
         batch_size: int,
         items_to_body: Callable[[List[Any]], Dict],
-        service_name: str
+        service_name: str,
+        dispatcher: Optional[PriorityDispatcher] = None,
+        lane: Lane = Lane.BULK,
+        rate_limiter: Optional[RateLimiter] = None,
+        items_to_tokens: Optional[Callable[[List[Any]], int]] = None,
+        transport: Optional[Transport] = None,
 ) -> List[Dict]:
     """Helper function around a concurrent set of JSON->JSON posts.
 
     * The list of items is split into batches of size `batch_size`
     * Each batch is transformed into a post body
     * Those post bodies are concurrently run as json_post(url, headers, body)
+    * If a `dispatcher` is provided, every attempt is admitted through it in the given `lane`
+    * If a `rate_limiter` is provided, every attempt first reserves one request and `items_to_tokens(batch)` tokens
+    * Requests are sent with `transport`, by default over HTTP/1.1 with aiohttp. On the transport's own event loop
+      its shared session is used, and stays open for later calls
     """
-    async with aiohttp.ClientSession(headers=headers) as session:
+    transport = transport or default_transport()
+    async with transport.borrow_session(headers) as session:
         tasks = []
         for batch in list_batches(items, batch_size):
             body = items_to_body(batch)
-            tasks.append(asyncio.ensure_future(_json_post(session, url, body, service_name)))
+            tokens = items_to_tokens(batch) if items_to_tokens is not None else 0
+            tasks.append(asyncio.ensure_future(
+                _json_post(transport, session, url, body, service_name, dispatcher, lane, rate_limiter, tokens)
+            ))
 
         result_bodies = await asyncio.gather(*tasks)
         return result_bodies
@@ -83,6 +174,106 @@ def concurrent_json_posts(
         items: List[Any],
         batch_size: int,
         items_to_body: Callable[[List[Any]], Dict],
-        service_name: str
+        service_name: str,
+        dispatcher: Optional[PriorityDispatcher] = None,
+        lane: Lane = Lane.BULK,
+        rate_limiter: Optional[RateLimiter] = None,
+        items_to_tokens: Optional[Callable[[List[Any]], int]] = None,
+        transport: Optional[Transport] = None,
 ) -> List[Dict]:
-    return asyncio.run(async_concurrent_json_posts(url, headers, items, batch_size, items_to_body, service_name))
+    """Synchronous form of `async_concurrent_json_posts`, run on the transport's event loop so that every call reuses
+    its open connections."""
+    transport = transport or default_transport()
+    return transport.run(async_concurrent_json_posts(
+        url, headers, items, batch_size, items_to_body, service_name,
+        dispatcher, lane, rate_limiter, items_to_tokens, transport
+    ))
+
+
+async def async_iter_json_posts(
+        url: str,
+        headers: Dict,
+        items: List[Any],
+        batch_size: int,
+        items_to_body: Callable[[List[Any]], Dict],
+        service_name: str,
+        dispatcher: Optional[PriorityDispatcher] = None,
+        lane: Lane = Lane.BULK,
+        rate_limiter: Optional[RateLimiter] = None,
+        items_to_tokens: Optional[Callable[[List[Any]], int]] = None,
+        transport: Optional[Transport] = None,
+) -> AsyncIterator[Tuple[int, Dict]]:
+    """Like `async_concurrent_json_posts`, but yields each batch as soon as it completes.
+
+    Yields (offset of the batch's first item in `items`, response body) in completion order. Batches still in flight
+    are cancelled if the caller stops iterating.
+    """
+    transport = transport or default_transport()
+
+    async def post(offset: int, batch: List[Any]) -> Tuple[int, Dict]:
+        tokens = items_to_tokens(batch) if items_to_tokens is not None else 0
+        body = await _json_post(
+            transport, session, url, items_to_body(batch), service_name, dispatcher, lane, rate_limiter, tokens
+        )
+        return offset, body
+
+    async with transport.borrow_session(headers) as session:
+        tasks = [
+            asyncio.ensure_future(post(offset, items[offset:offset + batch_size]))
+            for offset in range(0, len(items), batch_size)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def iter_json_posts(
+        url: str,
+        headers: Dict,
+        items: List[Any],
+        batch_size: int,
+        items_to_body: Callable[[List[Any]], Dict],
+        service_name: str,
+        dispatcher: Optional[PriorityDispatcher] = None,
+        lane: Lane = Lane.BULK,
+        rate_limiter: Optional[RateLimiter] = None,
+        items_to_tokens: Optional[Callable[[List[Any]], int]] = None,
+        transport: Optional[Transport] = None,
+) -> Iterator[Tuple[int, Dict]]:
+    """Synchronous form of `async_iter_json_posts`.
+
+    The requests run on the transport's event loop thread, so batches keep completing while the caller is busy with
+    the ones already yielded.
+    """
+    transport = transport or default_transport()
+    results: queue.Queue = queue.Queue()
+    finished = object()
+
+    async def produce():
+        posts = async_iter_json_posts(
+            url, headers, items, batch_size, items_to_body, service_name,
+            dispatcher, lane, rate_limiter, items_to_tokens, transport
+        )
+        try:
+            async for result in posts:
+                results.put(result)
+        except Exception as e:
+            results.put(e)
+        finally:
+            await posts.aclose()
+            results.put(finished)
+
+    future = transport.submit(produce())
+    try:
+        while True:
+            result = results.get()
+            if result is finished:
+                return
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        future.cancel()
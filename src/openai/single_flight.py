@@ -0,0 +1,88 @@
+"""Coalescing of concurrent requests for the same embedding.
+
+When several invocations in one process embed the same text at the same time (a hot query, a header shared by files
+ingested in parallel), only the first should reach OpenAI. `SingleFlight` tracks the texts currently in flight: the
+first caller to claim a key becomes its leader and sends it, and every concurrent caller claiming the same key
+follows, waiting on the leader's future instead of sending a duplicate.
+
+Nothing is kept once a request completes; this is not a cache. Invocations wait on their own threads while their
+posts run on the transports' shared event loop thread, so the in-flight results are `concurrent.futures.Future`s,
+which any thread can wait on.
+
+- Keys include the dispatch lane, so an interactive caller never waits on a bulk leader's queueing and retries.
+- A leader resolves each text's future as soon as the batch holding it completes, not when its whole request does.
+- If one of the leader's batches fails, the followers of texts not yet resolved receive the same error.
+- If the leader is cancelled or interrupted, its unresolved futures are cancelled and followers claim the keys again.
+"""
+import threading
+import unicodedata
+from concurrent.futures import Future
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+from openai.dispatcher import Lane
+
+Key = Tuple[str, str, Lane]
+
+
+def flight_key(model: str, text: str, lane: Lane) -> Key:
+    return model, unicodedata.normalize("NFC", text), lane
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._sent = 0
+        self._coalesced = 0
+
+    def claim(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, Future], Dict[Hashable, Future]]:
+        """Splits `keys` into those the caller now leads and those already in flight for another caller."""
+        leading, following = {}, {}
+        with self._lock:
+            for key in keys:
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = Future()
+                    self._in_flight[key] = future
+                    leading[key] = future
+                else:
+                    following[key] = future
+            self._sent += len(leading)
+            self._coalesced += len(following)
+        return leading, following
+
+    def _release(self, leading: Dict[Hashable, Future]):
+        with self._lock:
+            for key, future in leading.items():
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+
+    def complete(self, leading: Dict[Hashable, Future], results: Dict[Hashable, object]):
+        """Resolves every led future; a key missing from `results` fails its followers instead of stranding them."""
+        self._release(leading)
+        for key, future in leading.items():
+            if key in results:
+                future.set_result(results[key])
+            else:
+                future.set_exception(KeyError(f"No result for {key!r} from the leading request"))
+
+    def fail(self, leading: Dict[Hashable, Future], error: BaseException):
+        self._release(leading)
+        for future in leading.values():
+            future.set_exception(error)
+
+    def abandon(self, leading: Dict[Hashable, Future]):
+        """Gives up leadership without a result, letting followers claim the keys themselves."""
+        self._release(leading)
+        for future in leading.values():
+            future.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        """`sent`: keys this process sent itself. `coalesced`: keys that waited on another caller's request."""
+        with self._lock:
+            return {"sent": self._sent, "coalesced": self._coalesced, "in_flight": len(self._in_flight)}
+
+
+def unique(keys: List[Hashable]) -> List[Hashable]:
+    """The distinct keys, in order of first appearance."""
+    return list(dict.fromkeys(keys))
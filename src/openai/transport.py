@@ -0,0 +1,322 @@
+"""Pluggable HTTP transports for the JSON posts in `openai.request_utils`.
+
+A `TransportSession` is bound to the event loop it was opened on. Transports run the synchronous posts of
+`request_utils` on one shared event loop thread, and each keeps one shared session per set of headers open on it, so
+connections (and their TLS handshakes) are reused across calls and across the invocations of a warm instance rather
+than opened per call. Retries, timeouts and metrics live in `request_utils` and are shared by every transport, which
+only has to send a body and hand back the status and text of the response.
+
+- `AiohttpTransport` (the default) speaks HTTP/1.1, one connection per in-flight request.
+- `HttpxTransport` can speak HTTP/2, multiplexing the in-flight requests of all callers over a few connections. It
+  needs the optional `httpx[http2]` dependency.
+
+Sessions raise `ConnectionError` when a connection fails or is dropped, which `request_utils` retries: a kept-alive
+connection may have been closed by the server since its last use.
+"""
+import asyncio
+import atexit
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Dict, NamedTuple, Optional, Tuple
+
+from steamship import SteamshipError
+
+
+class TransportResponse(NamedTuple):
+    status: int
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+
+class TransportSession(ABC):
+    @abstractmethod
+    async def post(self, url: str, data: str) -> TransportResponse:
+        raise NotImplementedError()
+
+    async def connect(self, url: str):
+        """Opens a kept-alive connection to the host of `url` ahead of the first post, with a bodiless request."""
+
+
+class Transport(ABC):
+    """Opens sessions for a protocol.
+
+    `timeout_seconds` bounds every attempt and `metrics` records it; both are applied by `request_utils`. Timeouts are
+    enforced there, uniformly across transports, so sessions are opened without timeouts of their own.
+    """
+
+    DEFAULT_TIMEOUT_SECONDS = 300.0
+    CLOSE_TIMEOUT_SECONDS = 5.0
+
+    def __init__(
+            self,
+            timeout_seconds: Optional[float] = DEFAULT_TIMEOUT_SECONDS,
+            metrics: Optional["TransportMetrics"] = None,
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.metrics = metrics or TransportMetrics()
+        self._sessions: Dict[Tuple, Tuple[AsyncContextManager[TransportSession], asyncio.Task]] = {}
+
+    def preload(self):
+        """Imports the transport's HTTP library, which is otherwise imported on first use."""
+
+    @abstractmethod
+    def session(self, headers: Dict) -> AsyncContextManager[TransportSession]:
+        """Opens a session sending `headers` with every request, for use within the current event loop."""
+        raise NotImplementedError()
+
+    def run(self, coroutine: Awaitable) -> Any:
+        """Runs `coroutine` on the transports' event loop thread and returns its result.
+
+        If the calling thread is interrupted while waiting, the coroutine is cancelled.
+        """
+        future = self.submit(coroutine)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def submit(self, coroutine: Awaitable) -> Future:
+        """Schedules `coroutine` on the transports' event loop thread without waiting for it."""
+        return asyncio.run_coroutine_threadsafe(coroutine, _event_loop())
+
+    @asynccontextmanager
+    async def borrow_session(self, headers: Dict) -> AsyncIterator[TransportSession]:
+        """The shared session for `headers` when running on the transports' loop; it stays open after the block.
+
+        On any other event loop a session is opened for the block only.
+        """
+        if asyncio.get_running_loop() is not _LOOP:
+            async with self.session(headers) as session:
+                yield session
+            return
+
+        key = tuple(sorted(headers.items()))
+        entry = self._sessions.get(key)
+        if entry is None:
+            context = self.session(headers)
+            # Registered before awaiting, so concurrent callers wait on the same session rather than open another.
+            entry = (context, asyncio.ensure_future(context.__aenter__()))
+            self._sessions[key] = entry
+            _OPEN_TRANSPORTS.add(self)
+        try:
+            session = await asyncio.shield(entry[1])
+        except Exception:
+            if self._sessions.get(key) is entry:
+                del self._sessions[key]
+            raise
+        yield session
+
+    def close(self):
+        """Closes the transport's shared sessions; later calls open new ones.
+
+        Shared sessions are closed at interpreter exit; call this when discarding a transport before then.
+        """
+        if _LOOP is None or not self._sessions:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_sessions(), _LOOP).result(self.CLOSE_TIMEOUT_SECONDS)
+
+    async def _close_sessions(self):
+        sessions, self._sessions = list(self._sessions.values()), {}
+        for context, opened in sessions:
+            try:
+                await opened
+                await context.__aexit__(None, None, None)
+            except Exception:
+                pass
+
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+_OPEN_TRANSPORTS: "weakref.WeakSet[Transport]" = weakref.WeakSet()
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """The event loop, running on a daemon thread, that every transport sends its requests and keeps sessions on."""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="openai-transport-loop", daemon=True).start()
+            _LOOP = loop
+        return _LOOP
+
+
+_DEFAULT_TRANSPORT: Optional[Transport] = None
+
+
+def default_transport() -> Transport:
+    """The process-wide `AiohttpTransport` used when no transport is given, so that its sessions are shared."""
+    global _DEFAULT_TRANSPORT
+    with _LOOP_LOCK:
+        if _DEFAULT_TRANSPORT is None:
+            _DEFAULT_TRANSPORT = AiohttpTransport()
+        return _DEFAULT_TRANSPORT
+
+
+@atexit.register
+def _close_open_transports():
+    for transport in list(_OPEN_TRANSPORTS):
+        try:
+            transport.close()
+        except Exception:
+            pass
+
+
+class TransportMetrics:
+    """Counters updated by `request_utils` for every attempt, whichever transport sent it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+
+    def record(self, ok: bool, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.attempts += 1
+            self.failures += 0 if ok else 1
+            self.timeouts += 1 if timed_out else 0
+            self.seconds += seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "mean_seconds": self.seconds / self.attempts if self.attempts else 0.0,
+            }
+
+
+class _AiohttpSession(TransportSession):
+    def __init__(self, session):
+        self._session = session
+
+    async def post(self, url: str, data: str) -> TransportResponse:
+        import aiohttp
+
+        try:
+            async with self._session.post(url, data=data) as resp:
+                return TransportResponse(resp.status, await resp.text())
+        except aiohttp.ClientConnectionError as e:
+            raise ConnectionError(str(e) or type(e).__name__) from e
+
+    async def connect(self, url: str):
+        import aiohttp
+
+        try:
+            async with self._session.head(url):
+                pass
+        except aiohttp.ClientConnectionError as e:
+            raise ConnectionError(str(e) or type(e).__name__) from e
+
+
+class _AiohttpSessionContext:
+    def __init__(self, headers: Dict):
+        self._headers = headers
+        self._session = None
+
+    async def __aenter__(self) -> TransportSession:
+        import aiohttp
+
+        self._session = aiohttp.ClientSession(headers=self._headers, timeout=aiohttp.ClientTimeout(total=None))
+        return _AiohttpSession(self._session)
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+
+class AiohttpTransport(Transport):
+    def preload(self):
+        import aiohttp  # noqa: F401
+
+    def session(self, headers: Dict) -> AsyncContextManager[TransportSession]:
+        return _AiohttpSessionContext(headers)
+
+
+class _HttpxSession(TransportSession):
+    def __init__(self, client):
+        self._client = client
+
+    async def post(self, url: str, data: str) -> TransportResponse:
+        import httpx
+
+        try:
+            resp = await self._client.post(url, content=data)
+        except httpx.TransportError as e:
+            raise ConnectionError(str(e) or type(e).__name__) from e
+        return TransportResponse(resp.status_code, resp.text)
+
+    async def connect(self, url: str):
+        import httpx
+
+        try:
+            await self._client.head(url)
+        except httpx.TransportError as e:
+            raise ConnectionError(str(e) or type(e).__name__) from e
+
+
+class _HttpxSessionContext:
+    def __init__(self, transport: "HttpxTransport", headers: Dict):
+        self._transport = transport
+        self._headers = headers
+        self._client = None
+
+    async def __aenter__(self) -> TransportSession:
+        try:
+            import httpx
+        except ImportError as e:
+            raise SteamshipError(
+                message="The HTTP/2 transport requires httpx. Install it with `pip install httpx[http2]`.",
+                error=e,
+            )
+        limits = httpx.Limits(max_connections=self._transport.max_connections)
+        self._client = httpx.AsyncClient(
+            headers=self._headers,
+            http1=self._transport.http1,
+            http2=self._transport.http2,
+            limits=limits,
+            timeout=None,
+        )
+        return _HttpxSession(self._client)
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+
+
+class HttpxTransport(Transport):
+    """An httpx-based transport, negotiating HTTP/2 by default.
+
+    Over `https` HTTP/2 is negotiated with ALPN; set `http1=False` to speak HTTP/2 with prior knowledge, e.g. to a
+    cleartext server.
+    """
+
+    def __init__(
+            self,
+            http2: bool = True,
+            http1: bool = True,
+            max_connections: Optional[int] = 10,
+            timeout_seconds: Optional[float] = Transport.DEFAULT_TIMEOUT_SECONDS,
+            metrics: Optional[TransportMetrics] = None,
+    ):
+        super().__init__(timeout_seconds, metrics)
+        self.http2 = http2
+        self.http1 = http1
+        self.max_connections = max_connections
+
+    def preload(self):
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            pass
+
+    def session(self, headers: Dict) -> AsyncContextManager[TransportSession]:
+        return _HttpxSessionContext(self, headers)
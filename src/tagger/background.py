@@ -0,0 +1,155 @@
+"""Process-local bookkeeping for span tagging jobs that outlive a single invocation.
+
+Large files can take longer to tag than a single invocation is allowed to run. Rather than doing all of the work
+inside the HTTP request, the `SpanTagger` can hand the work to a `BackgroundJob`, return an in-progress status to
+the Steamship Engine, and answer the Engine's subsequent status checks from the job registered here.
+
+Jobs live in the memory of the process that started them, so a status check must land on the same warm instance.
+A status check for a job this process does not know fails with a `SteamshipError` naming the instance that started
+it: the work is lost and has to be submitted again. The status input echoed by the Engine carries that instance and
+the job's last reported progress so the loss is visible in the error.
+
+The work runs on a daemon thread after the invocation has returned. Runtimes that freeze or recycle the container
+once a response is sent, as serverless platforms may, stall that thread until the next invocation thaws it, or lose
+it altogether; background jobs should only be enabled where instances keep running between invocations.
+
+Finished jobs are kept until a status check collects them, or for `FINISHED_JOB_TTL_SECONDS` if none does, so that
+jobs whose status checks land elsewhere do not hold their output in memory for the life of the process.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from enum import Enum
+from typing import Any, Callable, Dict, Optional
+
+from steamship import SteamshipError
+
+FINISHED_JOB_TTL_SECONDS = 15 * 60
+
+# Identifies this process in status inputs, so that a status check landing elsewhere can say where the job ran.
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class BackgroundJobState(str, Enum):
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class BackgroundJob:
+    """A unit of span tagging work running on a background thread.
+
+    Attributes
+    ----------
+    job_id: str
+        Identifier echoed back by the Engine on status checks.
+    total_spans: int
+        Number of spans the job has to tag.
+    completed_spans: int
+        Number of spans tagged so far.
+    state: BackgroundJobState
+        Whether the job is still running, finished, or failed.
+    output: Any
+        The result of the job once it has succeeded.
+    error: Optional[SteamshipError]
+        The error that stopped the job, if it failed.
+    finished_at: Optional[float]
+        The `time.monotonic()` at which the job succeeded or failed.
+    """
+
+    def __init__(self, job_id: str, total_spans: int):
+        self.job_id = job_id
+        self.total_spans = total_spans
+        self.completed_spans = 0
+        self.state = BackgroundJobState.RUNNING
+        self.output: Any = None
+        self.error: Optional[SteamshipError] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add_progress(self, spans: int):
+        with self._lock:
+            self.completed_spans += spans
+
+    def status_message(self) -> str:
+        with self._lock:
+            return f"Tagged {self.completed_spans} of {self.total_spans} spans."
+
+    def status_input(self) -> Dict[str, Any]:
+        """The `remote_status_input` the Engine should echo back on status checks."""
+        return {
+            "job_id": self.job_id,
+            "instance": INSTANCE_ID,
+            "started_at": self.started_at,
+            "completed_spans": self.completed_spans,
+            "total_spans": self.total_spans,
+        }
+
+
+_JOBS: Dict[str, BackgroundJob] = {}
+_JOBS_LOCK = threading.Lock()
+
+
+def start_job(total_spans: int, work: Callable[[BackgroundJob], Any]) -> BackgroundJob:
+    """Registers a new job and runs `work(job)` on a daemon thread, storing its return value as the output."""
+    job = BackgroundJob(job_id=str(uuid.uuid4()), total_spans=total_spans)
+
+    def _run():
+        try:
+            job.output = work(job)
+            job.state = BackgroundJobState.SUCCEEDED
+        except Exception as e:
+            logging.error(f"Background job {job.job_id} failed.", exc_info=e)
+            job.error = e if isinstance(e, SteamshipError) else SteamshipError(
+                message=f"Background job {job.job_id} failed: {e}", error=e
+            )
+            job.state = BackgroundJobState.FAILED
+        job.finished_at = time.monotonic()
+
+    with _JOBS_LOCK:
+        _evict_expired_jobs()
+        _JOBS[job.job_id] = job
+    threading.Thread(target=_run, name=f"span-tagger-{job.job_id}", daemon=True).start()
+    return job
+
+
+def _evict_expired_jobs():
+    """Forgets jobs that finished more than `FINISHED_JOB_TTL_SECONDS` ago. Must hold `_JOBS_LOCK`."""
+    now = time.monotonic()
+    expired = [
+        job_id for job_id, job in _JOBS.items()
+        if job.finished_at is not None and now - job.finished_at > FINISHED_JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        logging.warning(f"Evicting background job {job_id}, which finished but was never collected.")
+        del _JOBS[job_id]
+
+
+def get_job(status_input: Dict[str, Any]) -> BackgroundJob:
+    """Returns the job described by a status input, or throws if this process does not know it."""
+    job_id = status_input.get("job_id")
+    with _JOBS_LOCK:
+        _evict_expired_jobs()
+        job = _JOBS.get(job_id) if job_id else None
+    if job is None:
+        raise SteamshipError(
+            message=(
+                f"Background job {job_id} is not known to instance {INSTANCE_ID}. It was started on instance "
+                f"{status_input.get('instance')}, which last reported {status_input.get('completed_spans')} of "
+                f"{status_input.get('total_spans')} spans tagged; that progress is lost. Jobs only survive on the "
+                f"instance that started them, and finished jobs are kept for {FINISHED_JOB_TTL_SECONDS} seconds."
+            ),
+            suggestion="Submit the tagging request again.",
+        )
+    return job
+
+
+def finish_job(job_id: str):
+    """Forgets a job once its final result has been handed back to the Engine."""
+    with _JOBS_LOCK:
+        _JOBS.pop(job_id, None)
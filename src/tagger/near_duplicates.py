@@ -0,0 +1,149 @@
+"""Detection of near-duplicate span texts with MinHash and locality-sensitive hashing.
+
+Corpora often contain many nearly identical blocks: templated emails, boilerplate with a changed date, successive
+versions of a document. Tagging each of them from scratch is wasted work when the result for one representative is
+good enough for all of them.
+
+Each text is normalized (lowercased, whitespace collapsed) and cut into overlapping character shingles. A MinHash
+signature is computed with one-permutation hashing: every shingle is hashed once and the minimum hash is kept per
+bin. Short texts have fewer shingles than bins, so empty bins are filled with optimal densification: each empty bin
+probes a fixed pseudo-random sequence of bins and borrows the value of the first non-empty one. Without that, every
+short text would share the all-empty bands of every other short text and become a candidate for it.
+
+Signatures are split into bands, and texts sharing any band become candidate pairs, whose exact Jaccard similarity
+over shingles then decides whether one may stand in for the other. Each band bucket keeps at most
+`MAX_BUCKET_SIZE` representatives, which bounds the comparisons per text when many texts are similar to each other
+without being near duplicates (short templated sentences, say) at the cost of missing some matches among them.
+"""
+import zlib
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+SHINGLE_SIZE = 5
+NUM_BINS = 64
+ROWS_PER_BAND = 4
+MAX_BUCKET_SIZE = 16
+# Probes tabulated per bin for densification; a text needs more only when almost all of its bins are empty.
+_TABULATED_PROBES = 128
+
+_EMPTY_BIN = 0xFFFFFFFF
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> FrozenSet[str]:
+    """The set of overlapping character `size`-grams of the normalized text."""
+    text = normalize(text)
+    if len(text) <= size:
+        return frozenset([text])
+    return frozenset(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+def signature(shingle_set: FrozenSet[str]) -> Tuple[int, ...]:
+    """A densified one-permutation MinHash signature of `NUM_BINS` values."""
+    bins = [_EMPTY_BIN] * NUM_BINS
+    for shingle in shingle_set:
+        h = zlib.crc32(shingle.encode("utf-8"))
+        b = h % NUM_BINS
+        if h < bins[b]:
+            bins[b] = h
+    return tuple(densify(bins))
+
+
+def _donor_bin(b: int, attempt: int) -> int:
+    """The `attempt`-th bin probed by empty bin `b`; the same for every text, so signatures stay comparable."""
+    x = (b * 0x9E3779B1 ^ attempt * 0x85EBCA77) & 0xFFFFFFFF
+    x = ((x ^ (x >> 15)) * 0x2C1B3C6D) & 0xFFFFFFFF
+    return (x ^ (x >> 12)) % NUM_BINS
+
+
+@lru_cache(maxsize=None)
+def _donor_bins() -> Tuple[Tuple[int, ...], ...]:
+    return tuple(tuple(_donor_bin(b, attempt) for attempt in range(_TABULATED_PROBES)) for b in range(NUM_BINS))
+
+
+def densify(bins: List[int]) -> List[int]:
+    """Fills each empty bin with the value of the first non-empty bin in its probe sequence.
+
+    Unlike borrowing from a neighbouring bin, independent probe sequences keep the chance of two texts agreeing on a
+    bin equal to their Jaccard similarity, so shingles shared by many short texts do not spread into whole bands.
+    """
+    if all(value == _EMPTY_BIN for value in bins):
+        return list(bins)
+    dense = list(bins)
+    donor_bins = _donor_bins()
+    for b, value in enumerate(bins):
+        if value != _EMPTY_BIN:
+            continue
+        for donor in donor_bins[b]:
+            value = bins[donor]
+            if value != _EMPTY_BIN:
+                break
+        attempt = _TABULATED_PROBES
+        while value == _EMPTY_BIN:
+            value = bins[_donor_bin(b, attempt)]
+            attempt += 1
+        dense[b] = value
+    return dense
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateIndex:
+    """An LSH index of representative texts that can be queried for a near duplicate of a new text."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._bands: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(NUM_BINS // ROWS_PER_BAND)]
+        self._shingles: Dict[int, FrozenSet[str]] = {}
+
+    def _band_keys(self, sig: Tuple[int, ...]):
+        for band in range(len(self._bands)):
+            yield band, sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+
+    def query(self, shingle_set: FrozenSet[str], sig: Tuple[int, ...]) -> Optional[Tuple[int, float]]:
+        """Returns the key and similarity of the most similar indexed text at or above the threshold, if any."""
+        candidates = set()
+        for band, key in self._band_keys(sig):
+            candidates.update(self._bands[band].get(key, ()))
+
+        best: Optional[Tuple[int, float]] = None
+        for candidate in candidates:
+            similarity = jaccard(shingle_set, self._shingles[candidate])
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        return best
+
+    def add(self, key: int, shingle_set: FrozenSet[str], sig: Tuple[int, ...]):
+        self._shingles[key] = shingle_set
+        for band, band_key in self._band_keys(sig):
+            bucket = self._bands[band].setdefault(band_key, [])
+            if len(bucket) < MAX_BUCKET_SIZE:
+                bucket.append(key)
+
+
+def find_near_duplicates(texts: List[str], threshold: float) -> Dict[int, Tuple[int, float]]:
+    """Maps the index of each text that can reuse an earlier text's result to (representative index, similarity).
+
+    Texts are considered in order; a text with no near duplicate among the earlier representatives becomes a
+    representative itself. Blank texts are ignored.
+    """
+    index = NearDuplicateIndex(threshold)
+    reuse: Dict[int, Tuple[int, float]] = {}
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        shingle_set = shingles(text)
+        sig = signature(shingle_set)
+        match = index.query(shingle_set, sig)
+        if match is not None:
+            reuse[i] = match
+        else:
+            index.add(i, shingle_set, sig)
+    return reuse
@@ -1,7 +1,8 @@
+import logging
 from abc import ABC, abstractmethod
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from steamship import Block, File, SteamshipError, Tag
+from steamship import Block, File, SteamshipError, Tag, Task, TaskState
 from steamship.base.model import CamelModel
 from steamship.invocable import InvocableResponse, post
 from steamship.invocable.plugin_service import PluginService
@@ -10,6 +11,7 @@ from steamship.plugin.outputs.block_and_tag_plugin_output import BlockAndTagPlug
 from steamship.plugin.outputs.plugin_output import UsageReport
 from steamship.plugin.request import PluginRequest
 
+from tagger.background import BackgroundJob, BackgroundJobState, finish_job, get_job, start_job
 from tagger.span import Granularity, Span
 
 
@@ -21,9 +23,15 @@ class SpanStreamingConfig(CamelModel):
 class SpanTagger(PluginService[BlockAndTagPluginInput, BlockAndTagPluginOutput], ABC):
     """An implementation of a Tagger that permits implementors to care only about Spans."""
 
+    # Number of spans tagged between progress updates when running as a background job.
+    BACKGROUND_PROGRESS_CHUNK_SIZE = 16
+
     def run(
         self, request: PluginRequest[BlockAndTagPluginInput]
     ) -> Union[InvocableResponse[BlockAndTagPluginOutput], BlockAndTagPluginOutput]:
+        if request.is_status_check:
+            return self._check_background_job(request)
+
         args = self.get_span_streaming_args()
 
         spans = [
@@ -34,6 +42,9 @@ class SpanTagger(PluginService[BlockAndTagPluginInput, BlockAndTagPluginOutput],
                 name_filter=args.name_filter
             )
         ]
+        if self.should_run_in_background(spans):
+            return self._start_background_job(request, args, spans)
+
         output_tags, usage_reports = self.tag_spans(
             PluginRequest(
                 data=spans,
@@ -42,13 +53,21 @@ class SpanTagger(PluginService[BlockAndTagPluginInput, BlockAndTagPluginOutput],
                 is_status_check=request.is_status_check
             )
         )
-
+        return self._build_output(request.data.file, args, output_tags, usage_reports)
+
+    def _build_output(
+        self,
+        file: File,
+        args: SpanStreamingConfig,
+        output_tags: List[Tag],
+        usage_reports: List[UsageReport]
+    ) -> BlockAndTagPluginOutput:
         # Now prepare the results. There's a bit of bookkeeping we have to do to make sure this is
         # structured properly with respect to the current BlockAndTag contract.
         block_lookup = {}
         output = BlockAndTagPluginOutput(file=File(), tags=[], usage=usage_reports)
         had_empty_block_ids = False
-        for block in request.data.file.blocks:
+        for block in file.blocks:
             output_block = Block(id=block.id, tags=[])
             if block.id is None:
                 had_empty_block_ids = True
@@ -58,7 +77,7 @@ class SpanTagger(PluginService[BlockAndTagPluginInput, BlockAndTagPluginOutput],
 
         # Go through each span and add to the appropriate place.
         for tag in output_tags:
-            if request.data.file.id is not None and tag.file_id is None:
+            if file.id is not None and tag.file_id is None:
                 raise SteamshipError(message="All Tags should have a file_id field")
 
             # Make sure the block_id has been provided correctly
@@ -97,6 +116,66 @@ class SpanTagger(PluginService[BlockAndTagPluginInput, BlockAndTagPluginOutput],
         # Finally, we can return the output
         return output
 
+    def _start_background_job(
+        self,
+        request: PluginRequest[BlockAndTagPluginInput],
+        args: SpanStreamingConfig,
+        spans: List[Span]
+    ) -> InvocableResponse[BlockAndTagPluginOutput]:
+        """Tags the spans on a background thread and immediately reports the work as running."""
+        file = request.data.file
+
+        def work(job: BackgroundJob) -> BlockAndTagPluginOutput:
+            spans_request = PluginRequest(data=spans, context=request.context)
+            # Near duplicates are found across the whole file, not within each progress chunk.
+            reusable_spans = self.find_reusable_spans(spans)
+            tags_by_span: List[List[Tag]] = []
+            all_tags, all_usage_reports = [], []
+            for i in range(0, len(spans), self.BACKGROUND_PROGRESS_CHUNK_SIZE):
+                end = min(i + self.BACKGROUND_PROGRESS_CHUNK_SIZE, len(spans))
+                tags, usage_reports = self._tag_span_range(spans_request, i, end, reusable_spans, tags_by_span)
+                all_tags.extend(tags)
+                all_usage_reports.extend(usage_reports)
+                job.add_progress(end - i)
+            return self._build_output(file, args, all_tags, all_usage_reports)
+
+        job = start_job(total_spans=len(spans), work=work)
+        logging.info(f"Tagging {len(spans)} spans in background job {job.job_id}")
+        return self._running_response(job)
+
+    def _check_background_job(
+        self, request: PluginRequest[BlockAndTagPluginInput]
+    ) -> Union[InvocableResponse[BlockAndTagPluginOutput], BlockAndTagPluginOutput]:
+        """Answers a status check with progress counts, the finished output, or the job's error."""
+        remote_status_input = (request.status.remote_status_input if request.status else None) or {}
+        job = get_job(remote_status_input)
+
+        if job.state == BackgroundJobState.RUNNING:
+            return self._running_response(job)
+
+        finish_job(job.job_id)
+        if job.state == BackgroundJobState.FAILED:
+            raise job.error
+        return job.output
+
+    @staticmethod
+    def _running_response(job: BackgroundJob) -> InvocableResponse[BlockAndTagPluginOutput]:
+        return InvocableResponse(
+            status=Task(
+                state=TaskState.running,
+                remote_status_input=job.status_input(),
+                remote_status_message=job.status_message(),
+            )
+        )
+
+    def should_run_in_background(self, spans: List[Span]) -> bool:
+        """Whether the spans are too much work to tag within a single invocation.
+
+        Returning True makes `run` hand the spans to a background job and report an in-progress status; the Engine
+        then polls with status checks until the output is ready. Defaults to always tagging synchronously.
+        """
+        return False
+
 
     @abstractmethod
     def get_span_streaming_args(self) -> SpanStreamingConfig:
@@ -105,17 +184,35 @@ class SpanTagger(PluginService[BlockAndTagPluginInput, BlockAndTagPluginOutput],
         raise NotImplementedError()
 
     def tag_spans(self, request: PluginRequest[List[Span]]) -> (List[Tag], Optional[List[UsageReport]]):
+        return self._tag_span_range(request, 0, len(request.data), self.find_reusable_spans(request.data), [])
+
+    def _tag_span_range(
+        self,
+        request: PluginRequest[List[Span]],
+        start: int,
+        end: int,
+        reusable_spans: Dict[int, Tuple[int, float]],
+        tags_by_span: List[List[Tag]]
+    ) -> (List[Tag], List[UsageReport]):
+        """Tags `request.data[start:end]`, appending each span's tags to `tags_by_span`, which must already hold
+        the tags of every earlier span so that reused spans can copy them."""
         all_tags, all_usage_reports = [], []
-        for span in request.data:
-            plugin_request = PluginRequest(
-                data=span,
-                context=request.context,
-                status=request.status,
-                is_status_check=request.is_status_check
-            )
-            tags, usage_reports = self.tag_span(plugin_request)
-            if usage_reports is not None: # Happens if span text is empty
-                all_usage_reports.extend(usage_reports)
+        for i in range(start, end):
+            span = request.data[i]
+            if i in reusable_spans:
+                source, similarity = reusable_spans[i]
+                tags = [self.reuse_tag(tag, similarity) for tag in tags_by_span[source]]
+            else:
+                plugin_request = PluginRequest(
+                    data=span,
+                    context=request.context,
+                    status=request.status,
+                    is_status_check=request.is_status_check
+                )
+                tags, usage_reports = self.tag_span(plugin_request)
+                if usage_reports is not None: # Happens if span text is empty
+                    all_usage_reports.extend(usage_reports)
+            tags_by_span.append(tags)
             for tag in tags:
                 tag.file_id = span.file_id
                 if span.granularity != Granularity.FILE:
@@ -130,6 +227,20 @@ class SpanTagger(PluginService[BlockAndTagPluginInput, BlockAndTagPluginOutput],
                 all_tags.append(tag)
         return all_tags, all_usage_reports
 
+    def find_reusable_spans(self, spans: List[Span]) -> Dict[int, Tuple[int, float]]:
+        """Maps the index of each span whose tags can be copied from an earlier span to (earlier index, similarity).
+
+        Spans listed here are not passed to `tag_span`. Defaults to tagging every span.
+        """
+        return {}
+
+    @staticmethod
+    def reuse_tag(tag: Tag, similarity: float) -> Tag:
+        """Copies a tag for a span that reuses another span's result, marking the copy as reused."""
+        reused = tag.copy(deep=True)
+        reused.value = {**(reused.value or {}), "reused": True, "similarity": similarity}
+        return reused
+
     @abstractmethod
     def tag_span(self, request: PluginRequest[Span]) -> List[Tag]:
         """The plugin author now just has to implement tagging over the provided spans."""
@@ -0,0 +1,64 @@
+import asyncio
+
+from openai.dispatcher import Lane, PriorityDispatcher
+
+
+async def _admitted(dispatcher: PriorityDispatcher, lane: Lane, order: list, name: str):
+    await dispatcher.acquire(lane)
+    order.append(name)
+
+
+def test_bulk_share_leaves_room_for_interactive():
+    async def scenario():
+        dispatcher = PriorityDispatcher(max_concurrency=2, bulk_concurrency=1)
+        await dispatcher.acquire(Lane.BULK)
+        waiting_bulk = asyncio.ensure_future(dispatcher.acquire(Lane.BULK))
+        await asyncio.sleep(0)
+        assert not waiting_bulk.done()
+
+        await asyncio.wait_for(dispatcher.acquire(Lane.INTERACTIVE), timeout=1)
+        assert dispatcher.in_flight(Lane.INTERACTIVE) == 1
+        waiting_bulk.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_interactive_preempts_queued_bulk():
+    async def scenario():
+        dispatcher = PriorityDispatcher(max_concurrency=2, bulk_concurrency=2)
+        await dispatcher.acquire(Lane.BULK)
+        await dispatcher.acquire(Lane.BULK)
+
+        order = []
+        bulk = asyncio.ensure_future(_admitted(dispatcher, Lane.BULK, order, "bulk"))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(_admitted(dispatcher, Lane.INTERACTIVE, order, "interactive"))
+        await asyncio.sleep(0)
+
+        dispatcher.release(Lane.BULK)
+        await asyncio.wait_for(interactive, timeout=1)
+        assert order == ["interactive"]
+
+        dispatcher.release(Lane.BULK)
+        await asyncio.wait_for(bulk, timeout=1)
+        assert order == ["interactive", "bulk"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        dispatcher = PriorityDispatcher(max_concurrency=1, bulk_concurrency=1)
+        await dispatcher.acquire(Lane.BULK)
+        waiting = asyncio.ensure_future(dispatcher.acquire(Lane.INTERACTIVE))
+        await asyncio.sleep(0)
+
+        # Release grants the slot to the waiter, which is cancelled before it gets to run.
+        dispatcher.release(Lane.BULK)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert dispatcher.in_flight(Lane.INTERACTIVE) == 0
+
+        await asyncio.wait_for(dispatcher.acquire(Lane.BULK), timeout=1)
+
+    asyncio.run(scenario())
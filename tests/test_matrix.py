@@ -0,0 +1,103 @@
+import base64
+from array import array
+
+import pytest
+
+from steamship.data import TagValueKey
+
+import openai.client
+from openai.client import OpenAIEmbeddingClient, OpenAIEmbeddingList
+from openai.matrix import EmbeddingMatrix, decode_embedding
+
+
+def _encode(vector) -> str:
+    return base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+
+
+def test_matrix_rows_are_contiguous():
+    matrix = EmbeddingMatrix.from_rows([array("f", [1, 2, 3]).tobytes(), array("f", [4, 5, 6]).tobytes()], dim=3)
+    assert matrix.shape == (2, 3)
+    assert matrix.data.tolist() == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+    assert matrix.row(1).tolist() == [4.0, 5.0, 6.0]
+    assert matrix.tolist() == [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+
+    with pytest.raises(ValueError):
+        EmbeddingMatrix.from_rows([array("f", [1, 2]).tobytes()], dim=3)
+
+
+def test_decode_embedding_round_trips_float32():
+    assert array("f", decode_embedding(_encode([0.25, -1.5]))).tolist() == [0.25, -1.5]
+
+
+def test_to_numpy_shares_memory():
+    np = pytest.importorskip("numpy")
+    matrix = EmbeddingMatrix(array("f", [1, 2, 3, 4]), rows=2, dim=2)
+    view = matrix.to_numpy()
+    assert view.dtype == np.float32 and view.shape == (2, 2)
+    matrix.data[3] = 9
+    assert view[1, 1] == 9
+
+
+def test_request_matrix_keeps_input_order(monkeypatch):
+    bodies = []
+
+    def fake_posts(url, headers, items, batch_size, items_to_body, *args):
+        for offset in range(0, len(items), batch_size):
+            batch = items[offset:offset + batch_size]
+            bodies.append(items_to_body(batch))
+            yield offset, {
+                "object": "list",
+                # OpenAI does not promise to return a batch's embeddings in input order.
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": _encode([float(len(text)), 1.0])}
+                    for i, text in reversed(list(enumerate(batch)))
+                ],
+                "usage": {"prompt_tokens": len(batch)},
+            }
+
+    monkeypatch.setattr(openai.client, "iter_json_posts", fake_posts)
+    texts = ["a" * n for n in range(1, 10)]
+    matrix, usage = OpenAIEmbeddingClient(key="test-key").request_matrix("text-embedding-ada-002", texts)
+
+    assert all(body["encoding_format"] == "base64" for body in bodies)
+    assert matrix.shape == (9, 2)
+    assert [matrix.row(i)[0] for i in range(9)] == [float(n) for n in range(1, 10)]
+    assert sum(report.operation_amount for report in usage) == 9
+
+
+def test_iter_embeddings_decodes_base64_batches(monkeypatch):
+    bodies = []
+
+    def fake_iter_posts(url, headers, items, batch_size, items_to_body, *args):
+        for offset in range(0, len(items), batch_size):
+            body = items_to_body(items[offset:offset + batch_size])
+            bodies.append(body)
+            yield offset, {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": _encode([float(len(text)), 1.0])}
+                    for i, text in reversed(list(enumerate(body["input"])))
+                ],
+                "usage": {"prompt_tokens": len(body["input"])},
+            }
+
+    monkeypatch.setattr(openai.client, "iter_json_posts", fake_iter_posts)
+    texts = ["a" * n for n in range(1, 10)]
+    batches = list(OpenAIEmbeddingClient(key="test-key").iter_embeddings("text-embedding-ada-002", texts))
+
+    assert all(body["encoding_format"] == "base64" for body in bodies)
+    assert [batch.offset for batch in batches] == [0, 6]
+    assert [batch.embeddings.shape for batch in batches] == [(6, 2), (3, 2)]
+    assert batches[1].embeddings.row(2).tolist() == [9.0, 1.0]
+
+
+def test_to_tags_builds_tags_from_matrix_rows():
+    embeddings = OpenAIEmbeddingList.parse_obj({
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": [float(i), 0.5]} for i in range(3)],
+    })
+
+    assert embeddings.to_matrix().shape == (3, 2)
+    tags = embeddings.to_tags("text-embedding-ada-002")
+    assert [tag.value[TagValueKey.VECTOR_VALUE] for tag in tags] == [[0.0, 0.5], [1.0, 0.5], [2.0, 0.5]]
+    assert tags[1].value == embeddings.data[1].to_tag("text-embedding-ada-002").value
@@ -0,0 +1,52 @@
+import pytest
+
+from tagger import near_duplicates
+from tagger.near_duplicates import find_near_duplicates, jaccard, shingles
+
+TEMPLATE = (
+    "Dear customer, your order {order} has shipped on {date}. It will arrive within five business days. "
+    "If you have any questions about your delivery, reply to this email and our support team will help you."
+)
+
+
+def test_templated_texts_reuse_first_representative():
+    texts = [
+        TEMPLATE.format(order="A-1001", date="March 3"),
+        TEMPLATE.format(order="A-1002", date="March 4"),
+        "A completely different sentence about the weather in the mountains this weekend.",
+        TEMPLATE.format(order="A-1003", date="March 5"),
+    ]
+    reuse = find_near_duplicates(texts, threshold=0.8)
+    assert set(reuse) == {1, 3}
+    assert reuse[1][0] == 0
+    assert reuse[3][0] == 0
+    assert 0.8 <= reuse[1][1] < 1.0
+
+
+def test_normalization_and_exact_repeats():
+    reuse = find_near_duplicates(["Hello   World", "hello world", "", "Goodbye"], threshold=0.95)
+    assert reuse == {1: (0, 1.0)}
+
+
+def test_dissimilar_texts_are_not_reused():
+    texts = [
+        "The quick brown fox jumps over the lazy dog.",
+        "Pack my box with five dozen liquor jugs.",
+    ]
+    assert find_near_duplicates(texts, threshold=0.5) == {}
+    assert jaccard(shingles(texts[0]), shingles(texts[1])) < 0.5
+
+
+@pytest.mark.parametrize("template", ["item {} ok", "short text number {} here"])
+def test_comparisons_grow_linearly_with_short_texts(monkeypatch, template):
+    comparisons = []
+
+    def counting_jaccard(a, b):
+        comparisons.append(1)
+        return jaccard(a, b)
+
+    monkeypatch.setattr(near_duplicates, "jaccard", counting_jaccard)
+    texts = [template.format(i) for i in range(2000)]
+    find_near_duplicates(texts, threshold=0.8)
+    # Comparing every short text with every earlier representative would take ~2M comparisons.
+    assert len(comparisons) < 100 * len(texts)
@@ -36,3 +36,10 @@ def test_embed(openai: OpenAIEmbeddingClient):
 
 
 
+@pytest.mark.usefixtures("openai")
+def test_embed_matrix(openai: OpenAIEmbeddingClient):
+    texts = ["apple", "orange", "banana", "kiwi", "blueberry", "car", "bicycle"]
+    matrix, usages = openai.request_matrix("text-embedding-ada-002", texts)
+    assert matrix.shape == (len(texts), MODEL_TO_DIMENSIONALITY["text-embedding-ada-002"])
+    tags, _ = openai.request("text-embedding-ada-002", texts)
+    assert tags[3][0].value[TagValueKey.VECTOR_VALUE] == pytest.approx(matrix.row(3).tolist(), abs=1e-6)
@@ -0,0 +1,95 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from openai.dispatcher import Lane
+from openai.rate_limiter import (
+    FileRateLimiter,
+    NetworkRateLimiter,
+    RateLimitServer,
+    RateLimits,
+    reserve,
+)
+
+ONE_PER_SECOND = RateLimits(requests_per_minute=60, burst_seconds=1.0)
+
+
+def test_reservations_queue_behind_burst():
+    state = {}
+    waits = [reserve(state, ONE_PER_SECOND, requests=1, tokens=0, now=100.0) for _ in range(3)]
+    assert waits == [0.0, 1.0, 2.0]
+    # Once the budget has refilled, requests go straight through again.
+    assert reserve(state, ONE_PER_SECOND, requests=1, tokens=0, now=200.0) == 0.0
+
+
+def test_token_budget_dominates_large_batches():
+    limits = RateLimits(requests_per_minute=6000, tokens_per_minute=600, burst_seconds=1.0)
+    state = {}
+    assert reserve(state, limits, requests=1, tokens=10, now=0.0) == 0.0
+    assert reserve(state, limits, requests=1, tokens=10, now=0.0) == pytest.approx(1.0)
+
+
+def test_interactive_reservations_skip_bulk_backlog():
+    limits = RateLimits(requests_per_minute=60, burst_seconds=10.0)
+    state = {}
+    bulk_waits = [reserve(state, limits, requests=1, tokens=0, now=0.0) for _ in range(20)]
+    assert bulk_waits[-1] == pytest.approx(10.0)
+    # The query only waits on the interactive share, not behind the ten seconds of queued bulk budget...
+    assert reserve(state, limits, requests=1, tokens=0, now=0.0, lane=Lane.INTERACTIVE) == 0.0
+    # ...but still counts against the shared budget, so the next bulk reservation waits for it.
+    assert reserve(state, limits, requests=1, tokens=0, now=0.0) == pytest.approx(12.0)
+
+
+def test_default_burst_lets_a_large_batch_through_an_idle_limiter():
+    limits = RateLimits(tokens_per_minute=10000)
+    assert reserve({}, limits, requests=1, tokens=8000, now=0.0) == 0.0
+
+
+def test_file_limiter_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "limits.json")
+    first, second = FileRateLimiter(path, ONE_PER_SECOND), FileRateLimiter(path, ONE_PER_SECOND)
+    waits = [first.reserve(1, 0), second.reserve(1, 0), first.reserve(1, 0)]
+    assert waits[0] == 0.0
+    assert waits[1] == pytest.approx(1.0, abs=0.1)
+    assert waits[2] == pytest.approx(2.0, abs=0.1)
+
+
+def test_network_limiter_is_shared_between_clients():
+    server = RateLimitServer("127.0.0.1", 0, ONE_PER_SECOND)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    first, second = NetworkRateLimiter(host, port), NetworkRateLimiter(host, port)
+    try:
+        waits = [first.reserve(1, 0), second.reserve(1, 0), first.reserve(1, 0)]
+        assert waits[0] == 0.0
+        assert waits[1] == pytest.approx(1.0, abs=0.1)
+        assert waits[2] == pytest.approx(2.0, abs=0.1)
+    finally:
+        first.close()
+        second.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_unreachable_network_limiter_does_not_wait():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    assert NetworkRateLimiter("127.0.0.1", port).reserve(1, 0) == 0.0
+
+
+def test_silent_network_limiter_is_skipped_after_one_timeout():
+    with socket.socket() as silent:
+        silent.bind(("127.0.0.1", 0))
+        silent.listen()
+        limiter = NetworkRateLimiter(*silent.getsockname())
+        start = time.monotonic()
+        waits = [limiter.reserve(1, 0) for _ in range(20)]
+        elapsed = time.monotonic() - start
+        limiter.close()
+
+    assert waits == [0.0] * 20
+    # Only the first reservation waits for the server; the rest skip it for the backoff period.
+    assert elapsed < 2 * NetworkRateLimiter.TIMEOUT_SECONDS
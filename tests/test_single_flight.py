@@ -0,0 +1,214 @@
+import base64
+import threading
+from array import array
+
+import pytest
+
+from steamship import SteamshipError
+from steamship.data import TagValueKey
+
+import openai.client
+from openai.client import OpenAIEmbeddingClient
+from openai.dispatcher import Lane
+from openai.single_flight import SingleFlight
+
+MODEL = "text-embedding-ada-002"
+
+
+class _FakePosts:
+    """Stands in for `iter_json_posts`, holding each batch in a held lane until `release` is set."""
+
+    def __init__(self, error: BaseException = None, held_lanes=(Lane.INTERACTIVE, Lane.BULK), fail_at: int = 0):
+        self.sent = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.error = error
+        self.held_lanes = held_lanes
+        self.fail_at = fail_at
+
+    def __call__(self, url, headers, items, batch_size, items_to_body, service_name, dispatcher, lane, *args):
+        self.sent.append(list(items))
+        for offset in range(0, len(items), batch_size):
+            batch = items[offset:offset + batch_size]
+            if lane in self.held_lanes:
+                self.started.set()
+                self.release.wait(5)
+            if self.error is not None and offset >= self.fail_at:
+                error, self.error = self.error, None
+                raise error
+            yield offset, {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": _encode([len(t)])} for i, t in enumerate(batch)
+                ],
+                "usage": {"prompt_tokens": len(batch)},
+            }
+
+
+def _encode(vector) -> str:
+    return base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+
+
+def _request_in_thread(client: OpenAIEmbeddingClient, inputs, outcome: dict, lane: Lane = None):
+    def run():
+        try:
+            outcome["result"] = client.request(MODEL, inputs, lane)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_until_following(client: OpenAIEmbeddingClient, count: int):
+    for _ in range(500):
+        if client.single_flight.stats()["coalesced"] >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("The second request never joined the in-flight one")
+
+
+def test_concurrent_identical_requests_are_coalesced(monkeypatch):
+    posts = _FakePosts()
+    monkeypatch.setattr(openai.client, "iter_json_posts", posts)
+    client = OpenAIEmbeddingClient(key="test-key")
+
+    first, second = {}, {}
+    first_thread = _request_in_thread(client, ["shared header", "only first"], first)
+    posts.started.wait(5)
+    second_thread = _request_in_thread(client, ["shared header", "shared header"], second)
+    _wait_until_following(client, 1)
+    posts.release.set()
+    first_thread.join(5)
+    second_thread.join(5)
+
+    assert posts.sent == [["shared header", "only first"]]
+    tags, usage = second["result"]
+    assert [t[0].value[TagValueKey.VECTOR_VALUE] for t in tags] == [[13.0], [13.0]]
+    assert usage == []
+    assert client.single_flight.stats() == {"sent": 2, "coalesced": 1, "in_flight": 0}
+
+
+def test_followers_receive_leader_error(monkeypatch):
+    posts = _FakePosts(error=SteamshipError(message="boom"))
+    monkeypatch.setattr(openai.client, "iter_json_posts", posts)
+    client = OpenAIEmbeddingClient(key="test-key")
+
+    first, second = {}, {}
+    first_thread = _request_in_thread(client, ["hot query"], first)
+    posts.started.wait(5)
+    second_thread = _request_in_thread(client, ["hot query"], second)
+    _wait_until_following(client, 1)
+    posts.release.set()
+    first_thread.join(5)
+    second_thread.join(5)
+
+    assert isinstance(first["error"], SteamshipError)
+    assert second["error"] is first["error"]
+    # Nothing is left in flight, so the next request is sent afresh.
+    assert client.request(MODEL, ["hot query"])[0][0][0].value[TagValueKey.VECTOR_VALUE] == [9.0]
+
+
+def test_followers_take_over_from_interrupted_leader(monkeypatch):
+    posts = _FakePosts(error=KeyboardInterrupt())
+    monkeypatch.setattr(openai.client, "iter_json_posts", posts)
+    client = OpenAIEmbeddingClient(key="test-key")
+
+    first, second = {}, {}
+    first_thread = _request_in_thread(client, ["hot query"], first)
+    posts.started.wait(5)
+    second_thread = _request_in_thread(client, ["hot query"], second)
+    _wait_until_following(client, 1)
+    posts.release.set()
+    first_thread.join(5)
+    second_thread.join(5)
+
+    assert isinstance(first["error"], KeyboardInterrupt)
+    assert second["result"][0][0][0].value[TagValueKey.VECTOR_VALUE] == [9.0]
+    assert posts.sent == [["hot query"], ["hot query"]]
+
+
+def test_duplicate_inputs_in_one_request_are_sent_once(monkeypatch):
+    posts = _FakePosts()
+    posts.release.set()
+    monkeypatch.setattr(openai.client, "iter_json_posts", posts)
+    client = OpenAIEmbeddingClient(key="test-key")
+
+    tags, usage = client.request(MODEL, ["a", "bb", "a"])
+    assert posts.sent == [["a", "bb"]]
+    assert [t[0].value[TagValueKey.VECTOR_VALUE] for t in tags] == [[1.0], [2.0], [1.0]]
+    assert tags[0][0].value[TagValueKey.VECTOR_VALUE] is not tags[2][0].value[TagValueKey.VECTOR_VALUE]
+
+
+def test_short_response_fails_followers_instead_of_stranding_them(monkeypatch):
+    posts = _FakePosts()
+    full_response = posts.__call__
+
+    def short_response(*args):
+        for offset, response in full_response(*args):
+            response["data"] = response["data"][:1]
+            yield offset, response
+
+    monkeypatch.setattr(openai.client, "iter_json_posts", short_response)
+    client = OpenAIEmbeddingClient(key="test-key")
+
+    first, second = {}, {}
+    first_thread = _request_in_thread(client, ["one", "two"], first)
+    posts.started.wait(5)
+    second_thread = _request_in_thread(client, ["two"], second)
+    _wait_until_following(client, 1)
+    posts.release.set()
+    first_thread.join(5)
+    second_thread.join(5)
+
+    assert not second_thread.is_alive()
+    assert isinstance(first["error"], SteamshipError)
+    assert second["error"] is first["error"]
+    assert client.single_flight.stats()["in_flight"] == 0
+
+
+def test_followers_of_completed_batches_survive_a_later_batch_failure(monkeypatch):
+    posts = _FakePosts(error=SteamshipError(message="boom"), fail_at=1)
+    monkeypatch.setattr(openai.client, "iter_json_posts", posts)
+    client = OpenAIEmbeddingClient(key="test-key")
+    client.BATCH_SIZE = 1
+
+    first, second = {}, {}
+    first_thread = _request_in_thread(client, ["early", "late"], first, Lane.BULK)
+    posts.started.wait(5)
+    second_thread = _request_in_thread(client, ["early"], second, Lane.BULK)
+    _wait_until_following(client, 1)
+    posts.release.set()
+    first_thread.join(5)
+    second_thread.join(5)
+
+    assert isinstance(first["error"], SteamshipError)
+    assert second["result"][0][0][0].value[TagValueKey.VECTOR_VALUE] == [5.0]
+    assert client.single_flight.stats()["in_flight"] == 0
+
+
+def test_interactive_request_does_not_wait_for_bulk_leader(monkeypatch):
+    posts = _FakePosts(held_lanes=(Lane.BULK,))
+    monkeypatch.setattr(openai.client, "iter_json_posts", posts)
+    client = OpenAIEmbeddingClient(key="test-key")
+
+    bulk = {}
+    bulk_thread = _request_in_thread(client, ["hot query"], bulk, Lane.BULK)
+    posts.started.wait(5)
+    tags, _ = client.request(MODEL, ["hot query"], Lane.INTERACTIVE)
+
+    assert tags[0][0].value[TagValueKey.VECTOR_VALUE] == [9.0]
+    assert bulk_thread.is_alive()
+    posts.release.set()
+    bulk_thread.join(5)
+    assert posts.sent == [["hot query"], ["hot query"]]
+
+
+def test_complete_resolves_keys_missing_from_results():
+    flight = SingleFlight()
+    leading, _ = flight.claim(["a", "b"])
+    flight.complete(leading, {"a": 1})
+    assert leading["a"].result(0) == 1
+    with pytest.raises(KeyError):
+        leading["b"].result(0)
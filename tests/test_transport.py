@@ -0,0 +1,104 @@
+import json
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+from benchmarks.stand_in import fake_response
+from openai.client import OpenAIEmbeddingClient
+from openai.transport import AiohttpTransport, HttpxTransport, Transport, TransportResponse, TransportSession
+
+MODEL = "text-embedding-ada-002"
+
+
+class _RecordingTransport(Transport):
+    """Answers every post in-process, recording the bodies it was sent."""
+
+    def __init__(self):
+        super().__init__()
+        self.bodies = []
+
+    @asynccontextmanager
+    async def session(self, headers):
+        transport = self
+
+        class Session(TransportSession):
+            async def post(self, url: str, data: str) -> TransportResponse:
+                body = json.loads(data)
+                transport.bodies.append(body)
+                return TransportResponse(200, json.dumps(fake_response(body)))
+
+        yield Session()
+
+
+def test_custom_transport_shares_metrics_hooks():
+    transport = _RecordingTransport()
+    client = OpenAIEmbeddingClient(key="test-key", transport=transport)
+    matrix, _ = client.request_matrix(MODEL, [f"text {i}" for i in range(8)])
+
+    assert matrix.shape == (8, 1536)
+    assert [len(body["input"]) for body in transport.bodies] == [6, 2]
+    metrics = transport.metrics.snapshot()
+    assert metrics["attempts"] == 2
+    assert metrics["failures"] == 0
+
+
+def test_prewarm_opens_the_connection_of_the_first_request():
+    from benchmarks.stand_in import stand_in_server
+
+    transport = AiohttpTransport()
+    with stand_in_server() as stand_in:
+        client = OpenAIEmbeddingClient(key="test-key", transport=transport)
+        client.URL = stand_in.url
+        client.prewarm()
+        assert stand_in.connections == 1
+        tags, _ = client.request(MODEL, ["hello"])
+        transport.close()
+
+    assert len(tags) == 1
+    assert stand_in.connections == 1
+
+
+def test_http2_transport_multiplexes_batches():
+    pytest.importorskip("h2")
+    pytest.importorskip("httpx")
+    from benchmarks.stand_in import stand_in_h2_server
+
+    delay_seconds = 0.2
+    transport = HttpxTransport(http1=False)
+    with stand_in_h2_server(delay_seconds=delay_seconds) as stand_in:
+        client = OpenAIEmbeddingClient(key="test-key", transport=transport)
+        client.URL = stand_in.url
+        texts = [f"text {i}" for i in range(30)]
+        start = time.monotonic()
+        tags, usage = client.request(MODEL, texts)
+        elapsed = time.monotonic() - start
+        transport.close()
+
+    assert len(tags) == 30
+    assert len(usage) == 5
+    # All 5 batches were in flight at once on one connection, rather than sent one after another.
+    assert stand_in.connections == 1
+    assert elapsed < 2.5 * delay_seconds
+
+
+@pytest.mark.parametrize("http2", [False, True])
+def test_sessions_stay_open_across_requests(http2):
+    if http2:
+        pytest.importorskip("h2")
+        pytest.importorskip("httpx")
+        from benchmarks.stand_in import stand_in_h2_server as server
+        transport = HttpxTransport(http1=False)
+    else:
+        from benchmarks.stand_in import stand_in_server as server
+        transport = AiohttpTransport()
+
+    with server() as stand_in:
+        client = OpenAIEmbeddingClient(key="test-key", transport=transport)
+        client.URL = stand_in.url
+        # One input per request, as the plugin sends each span.
+        for i in range(5):
+            client.request(MODEL, [f"span {i}"])
+        transport.close()
+
+    assert stand_in.connections == 1
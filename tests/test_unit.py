@@ -1,15 +1,26 @@
+import json
 import os
+import time
+from array import array
+from collections import OrderedDict
 from typing import List
 
 import pytest
-from steamship import Block, SteamshipError
+from steamship import Block, SteamshipError, TaskState
 from steamship.data.file import File
 from steamship.data.tags import DocTag, Tag, TagKind, TagValueKey
+from steamship.invocable import InvocableResponse
 from steamship.plugin.inputs.block_and_tag_plugin_input import BlockAndTagPluginInput
+from steamship.plugin.outputs.block_and_tag_plugin_output import BlockAndTagPluginOutput
+from steamship.plugin.outputs.plugin_output import OperationType, OperationUnit, UsageReport
 from steamship.plugin.request import PluginRequest
 
+import api
 from api import OpenAIEmbedderPlugin
 from openai.api_spec import MODEL_TO_DIMENSIONALITY
+from openai.client import EmbeddingBatch
+from openai.matrix import EmbeddingMatrix
+from tagger import background
 from tagger.span import Granularity
 
 
@@ -113,4 +124,183 @@ def test_invalid_model_for_billing():
 
     with pytest.raises(SteamshipError) as e:
         _ = OpenAIEmbedderPlugin(config={'model': 'a model that does not exist', 'api_key':""})
-        assert "This plugin cannot be used with model" in str(e)
\ No newline at end of file
+        assert "This plugin cannot be used with model" in str(e)
+
+def _fake_request(model: str, inputs: List[str], **kwargs):
+    tags = [[Tag(kind=TagKind.EMBEDDING, name=model, value={TagValueKey.VECTOR_VALUE: [float(len(text))]})]
+            for text in inputs]
+    return tags, []
+
+
+def _poll_background_job(embedder: OpenAIEmbedderPlugin, status):
+    job_id = status.remote_status_input["job_id"]
+    for _ in range(100):
+        result = embedder.run(PluginRequest(is_status_check=True, status=status))
+        if not isinstance(result, InvocableResponse):
+            break
+        assert result.status.remote_status_input["job_id"] == job_id
+        status = result.status
+        time.sleep(0.01)
+    return result, status
+
+
+def test_background_job_status_checks(monkeypatch):
+    embedder = OpenAIEmbedderPlugin(config={
+        "api_key": "test-key",
+        "background_span_threshold": 2,
+    })
+    monkeypatch.setattr(embedder.client, "request", _fake_request)
+    file = _file_from_string("one\ntwo two\nthree three three")
+
+    response = embedder.run(PluginRequest(data=BlockAndTagPluginInput(file=file)))
+    assert isinstance(response, InvocableResponse)
+    assert response.status.state == TaskState.running
+
+    result, status = _poll_background_job(embedder, response.status)
+    assert isinstance(result, BlockAndTagPluginOutput)
+    for block_in, block_out in zip(file.blocks, result.file.blocks):
+        assert len(block_out.tags) == 1
+        assert block_out.tags[0].value[TagValueKey.VECTOR_VALUE] == [float(len(block_in.text))]
+
+    # The finished job is forgotten, so a repeated status check reports it as lost.
+    with pytest.raises(SteamshipError):
+        embedder.run(PluginRequest(is_status_check=True, status=status))
+
+
+def test_uncollected_finished_jobs_are_evicted(monkeypatch):
+    job = background.start_job(total_spans=1, work=lambda job: "output")
+    for _ in range(100):
+        if job.finished_at is not None:
+            break
+        time.sleep(0.01)
+    status_input = job.status_input()
+    assert background.get_job(status_input) is job
+
+    monkeypatch.setattr(background, "FINISHED_JOB_TTL_SECONDS", 0)
+    with pytest.raises(SteamshipError) as e:
+        background.get_job(status_input)
+    assert background.INSTANCE_ID in e.value.message
+    assert job.job_id not in background._JOBS
+
+
+def test_small_requests_run_synchronously(monkeypatch):
+    embedder = OpenAIEmbedderPlugin(config={
+        "api_key": "test-key",
+        "background_span_threshold": 5,
+    })
+    monkeypatch.setattr(embedder.client, "request", _fake_request)
+    file = _file_from_string("one\ntwo two")
+
+    response = embedder.run(PluginRequest(data=BlockAndTagPluginInput(file=file)))
+    assert isinstance(response, BlockAndTagPluginOutput)
+    assert all(len(block.tags) == 1 for block in response.file.blocks)
+
+
+def test_warm_instances_reuse_client():
+    first = OpenAIEmbedderPlugin(config={"api_key": "test-key"})
+    second = OpenAIEmbedderPlugin(config={"api_key": "test-key", "granularity": Granularity.TAG})
+    other = OpenAIEmbedderPlugin(config={"api_key": "other-key"})
+    assert first.client is second.client
+    assert first.client is not other.client
+
+    # A cached client must not let an invalid config through on a warm instance.
+    for _ in range(2):
+        with pytest.raises(SteamshipError):
+            OpenAIEmbedderPlugin(config={"api_key": "test-key", "model": "not-a-model"})
+
+
+def test_client_cache_closes_evicted_clients(monkeypatch):
+    monkeypatch.setattr(api, "_CLIENTS", OrderedDict())
+    monkeypatch.setattr(api, "MAX_CACHED_CLIENTS", 2)
+    clients = [OpenAIEmbedderPlugin(config={"api_key": f"key {i}"}).client for i in range(2)]
+    closed = []
+    for client in clients:
+        client.transport.close = lambda client=client: closed.append(client)
+
+    assert OpenAIEmbedderPlugin(config={"api_key": "key 0"}).client is clients[0]
+    OpenAIEmbedderPlugin(config={"api_key": "key 2"})
+    assert closed == [clients[1]]
+    assert list(api._CLIENTS.values())[0] is clients[0]
+
+
+def test_near_duplicate_spans_reuse_embeddings(monkeypatch):
+    embedder = OpenAIEmbedderPlugin(config={
+        "api_key": "test-key",
+        "near_duplicate_threshold": 0.8,
+    })
+    sent = []
+
+    def _recording_request(model: str, inputs: List[str], **kwargs):
+        sent.extend(inputs)
+        return _fake_request(model, inputs)
+
+    monkeypatch.setattr(embedder.client, "request", _recording_request)
+    line = "Your invoice for the month of {} is attached. Please pay within thirty days of receipt."
+    file = _file_from_string("\n".join([line.format("May"), line.format("June"), "Something else entirely."]))
+
+    response = embedder.run(PluginRequest(data=BlockAndTagPluginInput(file=file)))
+    assert sent == [line.format("May"), "Something else entirely."]
+    reused = response.file.blocks[1].tags[0]
+    assert reused.value["reused"] is True
+    assert reused.value[TagValueKey.VECTOR_VALUE] == response.file.blocks[0].tags[0].value[TagValueKey.VECTOR_VALUE]
+    assert reused.start_idx == 0 and reused.end_idx == len(line.format("June"))
+    assert "reused" not in response.file.blocks[0].tags[0].value
+
+
+def test_background_jobs_reuse_embeddings_across_progress_chunks(monkeypatch):
+    embedder = OpenAIEmbedderPlugin(config={
+        "api_key": "test-key",
+        "near_duplicate_threshold": 0.8,
+        "background_span_threshold": 1,
+    })
+    monkeypatch.setattr(embedder, "BACKGROUND_PROGRESS_CHUNK_SIZE", 2)
+    sent = []
+
+    def _recording_request(model: str, inputs: List[str], **kwargs):
+        sent.extend(inputs)
+        return _fake_request(model, inputs)
+
+    monkeypatch.setattr(embedder.client, "request", _recording_request)
+    line = "Your invoice for the month of {} is attached. Please pay within thirty days of receipt."
+    file = _file_from_string("\n".join([line.format("May"), "Something else entirely.", line.format("June")]))
+
+    response = embedder.run(PluginRequest(data=BlockAndTagPluginInput(file=file)))
+    result, _ = _poll_background_job(embedder, response.status)
+    assert isinstance(result, BlockAndTagPluginOutput)
+    assert sent == [line.format("May"), "Something else entirely."]
+    assert result.file.blocks[2].tags[0].value["reused"] is True
+
+
+def test_stream_yields_ndjson_per_batch(monkeypatch):
+    embedder = OpenAIEmbedderPlugin(config={"api_key": "test-key"})
+    file = _file_from_string("alpha\nbeta beta\n\ngamma gamma gamma")
+
+    def _fake_iter_embeddings(model: str, inputs: List[str], lane=None):
+        # Complete the second batch first, as the real client may.
+        yield EmbeddingBatch(offset=2, embeddings=_matrix([len(inputs[2])]), usage=_usage(3))
+        yield EmbeddingBatch(offset=0, embeddings=_matrix([len(text) for text in inputs[:2]]), usage=_usage(4))
+
+    monkeypatch.setattr(embedder.client, "iter_embeddings", _fake_iter_embeddings)
+    lines = list(embedder.stream(PluginRequest(data=BlockAndTagPluginInput(file=file))))
+    records = [json.loads(line) for line in lines]
+
+    assert all(line.endswith("\n") for line in lines)
+    assert [record["block_id"] for record in records[:-1]] == ["3", "0", "1"]
+    for record in records[:-1]:
+        block = file.blocks[int(record["block_id"])]
+        assert record["vector"] == [float(len(block.text))]
+        assert (record["start_idx"], record["end_idx"]) == (0, len(block.text))
+    assert [usage["operationAmount"] for usage in records[-1]["usage"]] == [3, 4]
+
+
+def _matrix(values: List[float]) -> EmbeddingMatrix:
+    """One single-dimensional row per value."""
+    return EmbeddingMatrix(array("f", values), rows=len(values), dim=1)
+
+
+def _usage(tokens: int) -> UsageReport:
+    return UsageReport(
+        operation_unit=OperationUnit.PROMPT_TOKENS,
+        operation_type=OperationType.RUN,
+        operation_amount=tokens,
+    )